@@ -0,0 +1,13 @@
+from __future__ import annotations
+
+from functools import lru_cache
+
+from aiogram import Bot
+from aiogram.enums import ParseMode
+
+from app.config import get_config, require_bot_token
+
+
+@lru_cache(maxsize=None)
+def get_bot() -> Bot:
+    return Bot(token=require_bot_token(get_config()), parse_mode=ParseMode.HTML)
@@ -2,11 +2,10 @@ from __future__ import annotations
 
 import os
 from dataclasses import dataclass
+from functools import lru_cache
 
 from dotenv import load_dotenv
 
-load_dotenv()
-
 
 def _parse_admin_ids(raw: str) -> set[int]:
     if not raw:
@@ -23,19 +22,122 @@ def _parse_admin_ids(raw: str) -> set[int]:
     return result
 
 
+def _parse_int(name: str, default: int, minimum: int = 0) -> int:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return max(int(raw), minimum)
+    except ValueError:
+        return default
+
+
+def _parse_float(name: str, default: float, minimum: float = 0.0) -> float:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return max(float(raw), minimum)
+    except ValueError:
+        return default
+
+
+def _parse_bool(name: str, default: bool) -> bool:
+    raw = os.getenv(name, "").strip().lower()
+    if not raw:
+        return default
+    return raw in {"1", "true", "yes", "on"}
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    rate: float
+    burst: int
+
+
+DEFAULT_RATE_LIMITS = {
+    "/api/me": RateLimit(rate=1.0, burst=10),
+    "/api/bootstrap": RateLimit(rate=1.0, burst=10),
+    "/api/rank": RateLimit(rate=1.0, burst=10),
+    "/api/leaderboard": RateLimit(rate=2.0, burst=20),
+    "/api/exchange": RateLimit(rate=0.1, burst=3),
+}
+
+
+def _parse_rate(raw: str) -> RateLimit | None:
+    rate_raw, _, burst_raw = raw.strip().partition(":")
+    try:
+        rate = float(rate_raw)
+        burst = int(burst_raw) if burst_raw else max(int(rate), 1)
+    except ValueError:
+        return None
+    if rate <= 0 or burst < 1:
+        return None
+    return RateLimit(rate=rate, burst=burst)
+
+
+def _parse_rate_limits(raw: str) -> dict[str, RateLimit]:
+    limits = dict(DEFAULT_RATE_LIMITS)
+    for part in raw.split(","):
+        path, _, value = part.partition("=")
+        path = path.strip()
+        limit = _parse_rate(value) if path else None
+        if limit is not None:
+            limits[path] = limit
+    return limits
+
+
 @dataclass(frozen=True)
 class Config:
     bot_token: str
     admin_ids: set[int]
     group_id: int | None
     webapp_url: str | None
+    bot_username: str | None
+    bot_identity_refresh: float
+    bot_mode: str
+    webhook_url: str | None
+    webhook_secret: str | None
+    update_concurrency: int
+    update_queue_size: int
+    webapp_host: str
+    webapp_port: int
     db_path: str
+    db_pool_readers: int
+    db_pool_timeout: float
+    db_busy_timeout_ms: int
+    db_write_retries: int
+    db_single_writer: bool
+    db_group_commit_ms: int
+    db_group_commit_size: int
+    ingest_flush_ms: int
+    ingest_batch_size: int
+    ingest_queue_size: int
+    user_cache_size: int
+    message_cooldown: int
+    message_min_length: int
+    leaderboard_max_age: float
+    rank_index_rebuild_interval: float
+    init_data_ttl: int
+    init_data_cache_size: int
+    invite_pool_size: int
+    invite_link_rate: float
+    notify_concurrency: int
+    notify_max_attempts: int
+    slow_query_ms: int
+    metrics_host: str
+    metrics_port: int
+    metrics_token: str | None
+    rate_limit_enabled: bool
+    rate_limits: dict[str, RateLimit]
+    rate_limit_ip: RateLimit
+    rate_limit_ip_header: str | None
+    rate_limit_max_keys: int
 
 
 def load_config() -> Config:
+    load_dotenv()
     bot_token = os.getenv("BOT_TOKEN", "").strip()
-    if not bot_token:
-        raise RuntimeError("BOT_TOKEN не задан в переменных окружения.")
 
     admin_ids = _parse_admin_ids(os.getenv("ADMIN_IDS", ""))
 
@@ -43,12 +145,105 @@ def load_config() -> Config:
     group_id = int(group_id_raw) if group_id_raw else None
 
     webapp_url = os.getenv("WEBAPP_URL", "").strip() or None
+    bot_username = os.getenv("BOT_USERNAME", "").strip().lstrip("@") or None
+    bot_identity_refresh = _parse_float("BOT_IDENTITY_REFRESH", 21600.0, minimum=60.0)
+    bot_mode = os.getenv("BOT_MODE", "polling").strip().lower() or "polling"
+    if bot_mode not in {"polling", "webhook"}:
+        raise RuntimeError("BOT_MODE должен быть polling или webhook.")
+    webhook_url = os.getenv("WEBHOOK_URL", "").strip().rstrip("/") or None
+    webhook_secret = os.getenv("WEBHOOK_SECRET", "").strip() or None
+    if bot_mode == "webhook" and not webhook_secret:
+        raise RuntimeError("WEBHOOK_SECRET обязателен в режиме webhook.")
+    update_concurrency = _parse_int("UPDATE_CONCURRENCY", 32, minimum=1)
+    update_queue_size = _parse_int("UPDATE_QUEUE_SIZE", 1000, minimum=1)
+    webapp_host = os.getenv("WEBAPP_HOST", "0.0.0.0").strip() or "0.0.0.0"
+    webapp_port = _parse_int("WEBAPP_PORT", 8000, minimum=1)
     db_path = os.getenv("DB_PATH", "./pappy.sqlite3").strip()
+    db_pool_readers = _parse_int("DB_POOL_READERS", 4, minimum=1)
+    db_pool_timeout = _parse_float("DB_POOL_TIMEOUT", 30.0, minimum=0.1)
+    db_busy_timeout_ms = _parse_int("DB_BUSY_TIMEOUT_MS", 5000)
+    db_write_retries = _parse_int("DB_WRITE_RETRIES", 5)
+    db_single_writer = _parse_bool("DB_SINGLE_WRITER", False)
+    db_group_commit_ms = min(_parse_int("DB_GROUP_COMMIT_MS", 0), 100)
+    db_group_commit_size = _parse_int("DB_GROUP_COMMIT_SIZE", 64, minimum=1)
+    ingest_flush_ms = min(_parse_int("INGEST_FLUSH_MS", 500, minimum=10), 5000)
+    ingest_batch_size = _parse_int("INGEST_BATCH_SIZE", 200, minimum=1)
+    ingest_queue_size = _parse_int("INGEST_QUEUE_SIZE", 10000, minimum=1)
+    user_cache_size = _parse_int("USER_CACHE_SIZE", 50000)
+    message_cooldown = _parse_int("MESSAGE_COOLDOWN", 10)
+    message_min_length = _parse_int("MESSAGE_MIN_LENGTH", 6, minimum=1)
+    leaderboard_max_age = _parse_float("LEADERBOARD_MAX_AGE", 10.0, minimum=1.0)
+    rank_index_rebuild_interval = _parse_float("RANK_INDEX_REBUILD_INTERVAL", 0.0)
+    init_data_ttl = _parse_int("INIT_DATA_TTL", 86400, minimum=60)
+    init_data_cache_size = _parse_int("INIT_DATA_CACHE_SIZE", 10000)
+    invite_pool_size = _parse_int("INVITE_POOL_SIZE", 20)
+    invite_link_rate = _parse_float("INVITE_LINK_RATE", 0.5, minimum=0.01)
+    notify_concurrency = _parse_int("NOTIFY_CONCURRENCY", 5, minimum=1)
+    notify_max_attempts = _parse_int("NOTIFY_MAX_ATTEMPTS", 8, minimum=1)
+    slow_query_ms = _parse_int("SLOW_QUERY_MS", 0)
+    metrics_host = os.getenv("METRICS_HOST", "127.0.0.1").strip() or "127.0.0.1"
+    metrics_port = _parse_int("METRICS_PORT", 0)
+    metrics_token = os.getenv("METRICS_TOKEN", "").strip() or None
+    rate_limit_enabled = _parse_bool("RATE_LIMIT_ENABLED", True)
+    rate_limits = _parse_rate_limits(os.getenv("RATE_LIMITS", ""))
+    rate_limit_ip = _parse_rate(os.getenv("RATE_LIMIT_IP", "")) or RateLimit(rate=20.0, burst=100)
+    rate_limit_ip_header = os.getenv("RATE_LIMIT_IP_HEADER", "").strip().lower() or None
+    rate_limit_max_keys = _parse_int("RATE_LIMIT_MAX_KEYS", 100000, minimum=16)
 
     return Config(
         bot_token=bot_token,
         admin_ids=admin_ids,
         group_id=group_id,
         webapp_url=webapp_url,
+        bot_username=bot_username,
+        bot_identity_refresh=bot_identity_refresh,
+        bot_mode=bot_mode,
+        webhook_url=webhook_url,
+        webhook_secret=webhook_secret,
+        update_concurrency=update_concurrency,
+        update_queue_size=update_queue_size,
+        webapp_host=webapp_host,
+        webapp_port=webapp_port,
         db_path=db_path,
+        db_pool_readers=db_pool_readers,
+        db_pool_timeout=db_pool_timeout,
+        db_busy_timeout_ms=db_busy_timeout_ms,
+        db_write_retries=db_write_retries,
+        db_single_writer=db_single_writer,
+        db_group_commit_ms=db_group_commit_ms,
+        db_group_commit_size=db_group_commit_size,
+        ingest_flush_ms=ingest_flush_ms,
+        ingest_batch_size=ingest_batch_size,
+        ingest_queue_size=ingest_queue_size,
+        user_cache_size=user_cache_size,
+        message_cooldown=message_cooldown,
+        message_min_length=message_min_length,
+        leaderboard_max_age=leaderboard_max_age,
+        rank_index_rebuild_interval=rank_index_rebuild_interval,
+        init_data_ttl=init_data_ttl,
+        init_data_cache_size=init_data_cache_size,
+        invite_pool_size=invite_pool_size,
+        invite_link_rate=invite_link_rate,
+        notify_concurrency=notify_concurrency,
+        notify_max_attempts=notify_max_attempts,
+        slow_query_ms=slow_query_ms,
+        metrics_host=metrics_host,
+        metrics_port=metrics_port,
+        metrics_token=metrics_token,
+        rate_limit_enabled=rate_limit_enabled,
+        rate_limits=rate_limits,
+        rate_limit_ip=rate_limit_ip,
+        rate_limit_ip_header=rate_limit_ip_header,
+        rate_limit_max_keys=rate_limit_max_keys,
     )
+
+
+@lru_cache(maxsize=None)
+def get_config() -> Config:
+    return load_config()
+
+
+def require_bot_token(config: Config) -> str:
+    if not config.bot_token:
+        raise RuntimeError("BOT_TOKEN не задан в переменных окружения.")
+    return config.bot_token
@@ -1,2 +1,2 @@
-from app.database.db import get_db
+from app.database.db import close_pool, get_db, get_read_db, open_pool, pool_stats, uow
 from app.database.schema import init_db
@@ -1,21 +1,480 @@
 from __future__ import annotations
 
+import asyncio
+import random
+import sqlite3
+import time
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Iterable
 
 import aiosqlite
 
-from app.config import load_config
+from app.config import get_config
+from app.services.metrics import (
+    db_busy_retries,
+    db_checkouts,
+    db_commit_seconds,
+    db_connections_opened,
+    db_lock_wait_seconds,
+    db_write_batch_size,
+    db_write_commit_wait_seconds,
+    db_write_queue_depth,
+)
 
-_config = load_config()
+MIN_SQLITE_VERSION = (3, 35, 0)
+_BUSY_BACKOFF_SECONDS = 0.05
+_MAX_BUSY_BACKOFF_SECONDS = 2.0
+
+
+def check_sqlite_version() -> None:
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        required = ".".join(str(part) for part in MIN_SQLITE_VERSION)
+        raise RuntimeError(
+            f"Нужна SQLite {required} или новее (UPSERT и RETURNING), "
+            f"установлена {sqlite3.sqlite_version}."
+        )
+
+
+class Connection(aiosqlite.Connection):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.uow_depth = 0
+        self._on_commit: list[list[Callable[[], None]]] = []
+
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        if self._on_commit:
+            self._on_commit[-1].append(callback)
+        else:
+            callback()
+
+    async def execute_fetchone(
+        self, sql: str, parameters: Iterable[Any] | None = None
+    ) -> aiosqlite.Row | None:
+        async with self.execute(sql, parameters) as cursor:
+            return await cursor.fetchone()
 
 
 @asynccontextmanager
-async def get_db() -> aiosqlite.Connection:
-    db = await aiosqlite.connect(_config.db_path)
-    db.row_factory = aiosqlite.Row
-    await db.execute("PRAGMA journal_mode=WAL")
-    await db.execute("PRAGMA synchronous=NORMAL")
+async def uow(db: Connection) -> AsyncIterator[Connection]:
+    depth = db.uow_depth
+    savepoint = f"uow_{depth}"
+    if depth == 0:
+        await _begin_immediate(db)
+    else:
+        await db.execute(f"SAVEPOINT {savepoint}")
+    db.uow_depth += 1
+    db._on_commit.append([])
+    try:
+        yield db
+    except BaseException:
+        db.uow_depth = depth
+        db._on_commit.pop()
+        if depth == 0:
+            await db.rollback()
+        else:
+            await db.execute(f"ROLLBACK TO {savepoint}")
+            await db.execute(f"RELEASE {savepoint}")
+        raise
+    db.uow_depth = depth
+    callbacks = db._on_commit.pop()
+    if depth > 0:
+        await db.execute(f"RELEASE {savepoint}")
+        db._on_commit[-1].extend(callbacks)
+        return
+    started = time.perf_counter()
     try:
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+    elapsed = time.perf_counter() - started
+    write_stats.record_commit(elapsed)
+    db_commit_seconds.labels().observe(elapsed)
+    for callback in callbacks:
+        callback()
+
+
+def _is_busy(exc: sqlite3.OperationalError) -> bool:
+    message = str(exc).lower()
+    return "locked" in message or "busy" in message
+
+
+async def _begin_immediate(db: Connection) -> None:
+    retries = get_config().db_write_retries
+    delay = _BUSY_BACKOFF_SECONDS
+    started = time.perf_counter()
+    for attempt in range(retries + 1):
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            db_lock_wait_seconds.labels("begin_immediate").observe(time.perf_counter() - started)
+            return
+        except sqlite3.OperationalError as exc:
+            if not _is_busy(exc) or attempt == retries:
+                raise
+        write_stats.busy_retries += 1
+        db_busy_retries.labels().inc()
+        await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        delay = min(delay * 2, _MAX_BUSY_BACKOFF_SECONDS)
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    waits: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    def record(self, waited: float, contended: bool) -> None:
+        self.checkouts += 1
+        if not contended:
+            return
+        self.waits += 1
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 6),
+            "max_wait_seconds": round(self.max_wait_seconds, 6),
+        }
+
+
+@dataclass
+class WriteStats:
+    commits: int = 0
+    commit_seconds: float = 0.0
+    max_commit_seconds: float = 0.0
+    busy_retries: int = 0
+
+    def record_commit(self, seconds: float) -> None:
+        self.commits += 1
+        self.commit_seconds += seconds
+        self.max_commit_seconds = max(self.max_commit_seconds, seconds)
+
+    def as_dict(self) -> dict[str, float]:
+        average = self.commit_seconds / self.commits if self.commits else 0.0
+        return {
+            "commits": self.commits,
+            "avg_commit_seconds": round(average, 6),
+            "max_commit_seconds": round(self.max_commit_seconds, 6),
+            "busy_retries": self.busy_retries,
+        }
+
+
+write_stats = WriteStats()
+
+
+def _pool_closed() -> RuntimeError:
+    return RuntimeError("Пул соединений с базой данных закрыт.")
+
+
+class _CommandFailed(Exception):
+    pass
+
+
+@dataclass(eq=False)
+class _WriteSlot:
+    granted: asyncio.Future[Connection]
+    done: asyncio.Future[bool]
+    committed: asyncio.Future[None]
+
+
+class SingleWriter:
+    def __init__(self, db: Connection, window: float, max_batch: int) -> None:
+        self._db = db
+        self._window = window
+        self._max_batch = max_batch
+        self._queue: asyncio.Queue[_WriteSlot] = asyncio.Queue()
+        self._task: asyncio.Task[None] | None = None
+        self.batches = 0
+        self.commands = 0
+        self.max_queue_depth = 0
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self._queue.empty():
+            slot = self._queue.get_nowait()
+            if not slot.granted.done():
+                slot.granted.set_exception(_pool_closed())
+        self._record_queue_depth()
+
+    @asynccontextmanager
+    async def slot(self, timeout: float) -> AsyncIterator[Connection]:
+        loop = asyncio.get_running_loop()
+        slot = _WriteSlot(loop.create_future(), loop.create_future(), loop.create_future())
+        self._queue.put_nowait(slot)
+        self._record_queue_depth()
+        try:
+            db = await asyncio.wait_for(asyncio.shield(slot.granted), timeout)
+        except BaseException:
+            if slot.granted.done() and not slot.granted.cancelled():
+                slot.done.set_result(False)
+            else:
+                slot.granted.cancel()
+            raise
+
+        succeeded = False
+        try:
+            yield db
+            succeeded = True
+        finally:
+            slot.done.set_result(succeeded)
+        started = time.perf_counter()
+        await slot.committed
+        db_write_commit_wait_seconds.labels().observe(time.perf_counter() - started)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            self._record_queue_depth()
+            applied: list[_WriteSlot] = []
+            try:
+                async with uow(self._db):
+                    await self._apply(first, applied)
+                    deadline = loop.time() + self._window
+                    while len(applied) < self._max_batch:
+                        try:
+                            slot = self._queue.get_nowait()
+                            self._record_queue_depth()
+                        except asyncio.QueueEmpty:
+                            remaining = deadline - loop.time()
+                            if remaining <= 0:
+                                break
+                            try:
+                                slot = await asyncio.wait_for(self._queue.get(), remaining)
+                            except asyncio.TimeoutError:
+                                break
+                            self._record_queue_depth()
+                        await self._apply(slot, applied)
+            except asyncio.CancelledError:
+                for slot in applied:
+                    if not slot.committed.done():
+                        slot.committed.set_exception(_pool_closed())
+                raise
+            except Exception as exc:
+                for slot in applied:
+                    if not slot.committed.done():
+                        slot.committed.set_exception(exc)
+                continue
+            finally:
+                if applied:
+                    self.batches += 1
+                    self.commands += len(applied)
+                    db_write_batch_size.labels().observe(len(applied))
+            for slot in applied:
+                if not slot.committed.done():
+                    slot.committed.set_result(None)
+
+    def _record_queue_depth(self) -> None:
+        depth = self._queue.qsize()
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        db_write_queue_depth.labels().set(depth)
+
+    async def _apply(self, slot: _WriteSlot, applied: list[_WriteSlot]) -> None:
+        if slot.granted.done():
+            return
+        applied.append(slot)
+        try:
+            async with uow(self._db):
+                slot.granted.set_result(self._db)
+                if not await slot.done:
+                    raise _CommandFailed
+        except _CommandFailed:
+            pass
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "batches": self.batches,
+            "commands": self.commands,
+            "avg_batch_size": round(self.commands / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        db_path: str,
+        readers: int,
+        timeout: float,
+        busy_timeout: float = 5.0,
+        single_writer: bool = False,
+    ) -> None:
+        self._db_path = db_path
+        self._readers_size = readers
+        self._timeout = timeout
+        self._busy_timeout = busy_timeout
+        self._single_writer_enabled = single_writer
+        self._single_writer: SingleWriter | None = None
+        self._writer: Connection | None = None
+        self._writer_lock = asyncio.Lock()
+        self._readers: asyncio.Queue[Connection] = asyncio.Queue()
+        self._all_readers: list[Connection] = []
+        self.writer_stats = PoolStats()
+        self.reader_stats = PoolStats()
+
+    async def _connect(self, read_only: bool) -> Connection:
+        db_path = self._db_path
+        busy_timeout = self._busy_timeout
+        db = Connection(
+            lambda: sqlite3.connect(db_path, timeout=busy_timeout, isolation_level=None),
+            iter_chunk_size=64,
+        )
+        await db
+        db_connections_opened.labels("reader" if read_only else "writer").inc()
+        db.row_factory = aiosqlite.Row
+        if read_only:
+            await db.execute("PRAGMA query_only=ON")
+        else:
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    async def open(self) -> None:
+        if self._writer is not None:
+            return
+        check_sqlite_version()
+        self._writer = await self._connect(read_only=False)
+        if self._single_writer_enabled:
+            config = get_config()
+            self._single_writer = SingleWriter(
+                self._writer,
+                window=config.db_group_commit_ms / 1000,
+                max_batch=config.db_group_commit_size,
+            )
+            self._single_writer.start()
+        for _ in range(self._readers_size):
+            reader = await self._connect(read_only=True)
+            self._all_readers.append(reader)
+            self._readers.put_nowait(reader)
+
+    async def close(self) -> None:
+        if self._single_writer is not None:
+            await self._single_writer.stop()
+            self._single_writer = None
+        async with self._writer_lock:
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+        for reader in self._all_readers:
+            await reader.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[Connection]:
+        if self._single_writer is not None:
+            started = time.perf_counter()
+            async with self._single_writer.slot(self._timeout) as db:
+                waited = time.perf_counter() - started
+                self.writer_stats.record(waited, contended=True)
+                db_checkouts.labels("writer").inc()
+                db_lock_wait_seconds.labels("writer").observe(waited)
+                yield db
+            return
+        contended = self._writer_lock.locked()
+        started = time.perf_counter()
+        await asyncio.wait_for(self._writer_lock.acquire(), self._timeout)
+        waited = time.perf_counter() - started
+        self.writer_stats.record(waited, contended)
+        db_checkouts.labels("writer").inc()
+        db_lock_wait_seconds.labels("writer").observe(waited)
+        try:
+            if self._writer is None:
+                raise _pool_closed()
+            db = self._writer
+            try:
+                yield db
+            finally:
+                if db.in_transaction:
+                    await db.rollback()
+                db.uow_depth = 0
+                db._on_commit.clear()
+        finally:
+            self._writer_lock.release()
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[Connection]:
+        contended = self._readers.empty()
+        started = time.perf_counter()
+        db = await asyncio.wait_for(self._readers.get(), self._timeout)
+        waited = time.perf_counter() - started
+        self.reader_stats.record(waited, contended)
+        db_checkouts.labels("reader").inc()
+        db_lock_wait_seconds.labels("reader").observe(waited)
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "readers": self._readers_size,
+            "idle_readers": self._readers.qsize(),
+            "writer": self.writer_stats.as_dict(),
+            "reader": self.reader_stats.as_dict(),
+            "writes": write_stats.as_dict(),
+            "single_writer": self._single_writer.stats() if self._single_writer else None,
+        }
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = asyncio.Lock()
+
+
+async def open_pool() -> ConnectionPool:
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            config = get_config()
+            pool = ConnectionPool(
+                config.db_path,
+                readers=config.db_pool_readers,
+                timeout=config.db_pool_timeout,
+                busy_timeout=config.db_busy_timeout_ms / 1000,
+                single_writer=config.db_single_writer,
+            )
+            await pool.open()
+            _pool = pool
+    return _pool
+
+
+async def close_pool() -> None:
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+
+def pool_stats() -> dict[str, Any]:
+    return _pool.stats() if _pool is not None else {}
+
+
+@asynccontextmanager
+async def get_db() -> AsyncIterator[Connection]:
+    pool = _pool or await open_pool()
+    async with pool.writer() as db:
+        yield db
+
+
+@asynccontextmanager
+async def get_read_db() -> AsyncIterator[Connection]:
+    pool = _pool or await open_pool()
+    async with pool.reader() as db:
         yield db
-    finally:
-        await db.close()
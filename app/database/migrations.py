@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Sequence
+
+from app.database.db import Connection, uow
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Connection], Awaitable[None]]
+
+
+async def current_version(db: Connection) -> int:
+    exists = await db.execute_fetchone(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    )
+    if exists is None:
+        return 0
+    row = await db.execute_fetchone("SELECT MAX(version) AS version FROM schema_version")
+    return int(row["version"]) if row and row["version"] is not None else 0
+
+
+async def apply_migrations(
+    db: Connection, migrations: Sequence[Migration]
+) -> list[int]:
+    if not migrations or await current_version(db) >= migrations[-1].version:
+        return []
+
+    applied: list[int] = []
+    async with uow(db):
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at INTEGER NOT NULL
+            )
+            """
+        )
+        version = await current_version(db)
+        for migration in migrations:
+            if migration.version <= version:
+                continue
+            await migration.apply(db)
+            await db.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (migration.version, migration.name, int(time.time())),
+            )
+            version = migration.version
+            applied.append(migration.version)
+    for migration in migrations:
+        if migration.version in applied:
+            logger.info("Применена миграция %d: %s", migration.version, migration.name)
+    return applied
@@ -1,78 +1,274 @@
 from __future__ import annotations
 
+import functools
+import logging
 import time
-from typing import Any
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Sequence, TypeVar, cast
 
 import aiosqlite
 
+from app.config import get_config
+from app.database.db import Connection, uow
+from app.services.metrics import db_query_rows, db_query_seconds
 
-async def ensure_user(db: aiosqlite.Connection, user_id: int, username: str | None) -> None:
-    row = await db.execute_fetchone("SELECT id, username FROM users WHERE id = ?", (user_id,))
-    if row is None:
-        await db.execute(
-            "INSERT INTO users (id, username, balance, invited_by, total_referrals, total_referral_messages) "
-            "VALUES (?, ?, 0, NULL, 0, 0)",
-            (user_id, username),
-        )
-        await db.commit()
-        return
+logger = logging.getLogger(__name__)
 
-    if username and row["username"] != username:
-        await db.execute("UPDATE users SET username = ? WHERE id = ?", (username, user_id))
-        await db.commit()
+_MAX_VARIABLES = 500
+_RANK_FETCH_SIZE = 4096
 
 
-async def get_user(db: aiosqlite.Connection, user_id: int) -> aiosqlite.Row | None:
-    return await db.execute_fetchone("SELECT * FROM users WHERE id = ?", (user_id,))
+@dataclass
+class CachedUser:
+    username: str | None
+    invited_by: int | None
+
+
+class UserCache:
+    def __init__(self, max_size: int | None = None) -> None:
+        self._max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[int, CachedUser] = OrderedDict()
 
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def max_size(self) -> int:
+        if self._max_size is None:
+            self._max_size = get_config().user_cache_size
+        return self._max_size
+
+    def get(self, user_id: int) -> CachedUser | None:
+        item = self._items.get(user_id)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(user_id)
+        return item
+
+    def put(self, user_id: int, username: str | None, invited_by: int | None) -> None:
+        if self.max_size <= 0:
+            return
+        self._items[user_id] = CachedUser(username=username, invited_by=invited_by)
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def set_username(self, user_id: int, username: str) -> None:
+        item = self._items.get(user_id)
+        if item is not None:
+            item.username = username
+
+    def set_invited_by(self, user_id: int, inviter_id: int) -> None:
+        item = self._items.get(user_id)
+        if item is not None:
+            item.invited_by = inviter_id
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+user_cache = UserCache()
+
+
+def _chunks(items: Sequence[Any], size: int = _MAX_VARIABLES) -> Iterator[Sequence[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def _placeholders(count: int) -> str:
+    return ", ".join("?" * count)
+
+
+QueryT = TypeVar("QueryT", bound=Callable[..., Awaitable[Any]])
+
+
+def _returned_rows(result: Any) -> int:
+    if isinstance(result, aiosqlite.Row):
+        return 1
+    if isinstance(result, list):
+        return len(result)
+    return 0
+
+
+def _timed(func: QueryT) -> QueryT:
+    name = func.__name__
+    seconds = db_query_seconds.labels(name)
+    rows = db_query_rows.labels(name)
+
+    @functools.wraps(func)
+    async def wrapper(db: Connection, *args: Any, **kwargs: Any) -> Any:
+        changes = db.total_changes
+        started = time.perf_counter()
+        result = None
+        try:
+            result = await func(db, *args, **kwargs)
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            touched = db.total_changes - changes + _returned_rows(result)
+            seconds.observe(elapsed)
+            rows.inc(touched)
+            slow_query_ms = get_config().slow_query_ms
+            if slow_query_ms and elapsed * 1000 >= slow_query_ms:
+                logger.warning(
+                    "Медленный запрос %s: %.1f мс, строк %d", name, elapsed * 1000, touched
+                )
+
+    return cast(QueryT, wrapper)
+
+
+@_timed
+async def ensure_user(
+    db: Connection, user_id: int, username: str | None
+) -> aiosqlite.Row:
+    cached = user_cache.get(user_id)
+    if cached is not None and (not username or cached.username == username):
+        row = await db.execute_fetchone("SELECT * FROM users WHERE id = ?", (user_id,))
+        if row is not None:
+            return row
 
-async def set_invited_by(
-    db: aiosqlite.Connection, user_id: int, inviter_id: int
-) -> bool:
     row = await db.execute_fetchone(
-        "SELECT invited_by FROM users WHERE id = ?", (user_id,)
+        "INSERT INTO users (id, username, balance, invited_by, total_referrals, total_referral_messages) "
+        "VALUES (?, ?, 0, NULL, 0, 0) "
+        "ON CONFLICT(id) DO UPDATE SET username = excluded.username "
+        "WHERE excluded.username IS NOT NULL AND users.username IS NOT excluded.username "
+        "RETURNING *",
+        (user_id, username),
     )
     if row is None:
-        return False
-    if row["invited_by"] is not None:
-        return False
+        row = await db.execute_fetchone("SELECT * FROM users WHERE id = ?", (user_id,))
+    db.on_commit(lambda: user_cache.put(user_id, row["username"], row["invited_by"]))
+    return row
 
-    await db.execute(
-        "UPDATE users SET invited_by = ? WHERE id = ?", (inviter_id, user_id)
-    )
-    await db.commit()
-    return True
 
+@_timed
+async def get_user(db: Connection, user_id: int) -> aiosqlite.Row | None:
+    row = await db.execute_fetchone("SELECT * FROM users WHERE id = ?", (user_id,))
+    if row is not None:
+        user_cache.put(user_id, row["username"], row["invited_by"])
+    return row
 
-async def referral_exists(
-    db: aiosqlite.Connection, inviter_id: int, invited_id: int
-) -> bool:
-    row = await db.execute_fetchone(
-        "SELECT 1 FROM referrals WHERE inviter_id = ? AND invited_id = ?",
-        (inviter_id, invited_id),
-    )
-    return row is not None
 
+@_timed
+async def get_current_user(
+    db: Connection, user_id: int, username: str | None
+) -> aiosqlite.Row | None:
+    row = await db.execute_fetchone("SELECT * FROM users WHERE id = ?", (user_id,))
+    if row is None or (username and row["username"] != username):
+        return None
+    user_cache.put(user_id, row["username"], row["invited_by"])
+    return row
 
-async def add_referral(
-    db: aiosqlite.Connection, inviter_id: int, invited_id: int
+
+@_timed
+async def set_invited_by(
+    db: Connection, user_id: int, inviter_id: int
 ) -> bool:
-    if await referral_exists(db, inviter_id, invited_id):
+    cached = user_cache.get(user_id)
+    if cached is not None and cached.invited_by is not None:
         return False
-    await db.execute(
-        "INSERT INTO referrals (inviter_id, invited_id, created_at) VALUES (?, ?, ?)",
-        (inviter_id, invited_id, int(time.time())),
-    )
-    await db.execute(
-        "UPDATE users SET total_referrals = total_referrals + 1 WHERE id = ?",
-        (inviter_id,),
+
+    row = await db.execute_fetchone(
+        "UPDATE users SET invited_by = ? WHERE id = ? AND invited_by IS NULL RETURNING id",
+        (inviter_id, user_id),
     )
-    await db.commit()
+    if row is None:
+        return False
+    db.on_commit(lambda: user_cache.set_invited_by(user_id, inviter_id))
     return True
 
 
+@_timed
+async def register_joins(
+    db: Connection,
+    members: Sequence[tuple[int, str | None]],
+    invite_link: str | None,
+) -> list[aiosqlite.Row]:
+    if not members:
+        return []
+
+    usernames = dict(members)
+    member_ids = list(usernames)
+    async with uow(db):
+        await db.executemany(
+            "INSERT INTO users (id, username, balance, invited_by, total_referrals, total_referral_messages) "
+            "VALUES (?, ?, 0, NULL, 0, 0) "
+            "ON CONFLICT(id) DO UPDATE SET username = excluded.username "
+            "WHERE excluded.username IS NOT NULL AND users.username IS NOT excluded.username",
+            list(usernames.items()),
+        )
+
+        link_inviter_id = None
+        if invite_link:
+            link_inviter_id = await get_inviter_by_invite_link(db, invite_link)
+        if link_inviter_id is not None:
+            for chunk in _chunks(member_ids):
+                await db.execute(
+                    "UPDATE users SET invited_by = ? "
+                    f"WHERE id IN ({_placeholders(len(chunk))}) AND invited_by IS NULL AND id != ?",
+                    (link_inviter_id, *chunk, link_inviter_id),
+                )
+
+        inviters: dict[int, int] = {}
+        resolved: dict[int, tuple[str | None, int | None]] = {}
+        for chunk in _chunks(member_ids):
+            rows = await db.execute_fetchall(
+                f"SELECT id, username, invited_by FROM users WHERE id IN ({_placeholders(len(chunk))})",
+                chunk,
+            )
+            for row in rows:
+                user_id = int(row["id"])
+                invited_by = row["invited_by"]
+                resolved[user_id] = (row["username"], invited_by)
+                if invited_by is not None and invited_by != user_id:
+                    inviters[user_id] = int(invited_by)
+
+        credited: dict[int, int] = defaultdict(int)
+        now_ts = int(time.time())
+        pairs = [(inviter_id, user_id, now_ts) for user_id, inviter_id in inviters.items()]
+        for chunk in _chunks(pairs, _MAX_VARIABLES // 3):
+            values = ", ".join("(?, ?, ?)" for _ in chunk)
+            rows = await db.execute_fetchall(
+                f"INSERT INTO referrals (inviter_id, invited_id, created_at) VALUES {values} "
+                "ON CONFLICT DO NOTHING RETURNING inviter_id",
+                [value for pair in chunk for value in pair],
+            )
+            for row in rows:
+                credited[int(row["inviter_id"])] += 1
+
+        by_count: dict[int, list[int]] = defaultdict(list)
+        for inviter_id, count in credited.items():
+            by_count[count].append(inviter_id)
+        updated: list[aiosqlite.Row] = []
+        for count, inviter_ids in by_count.items():
+            for chunk in _chunks(inviter_ids):
+                rows = await db.execute_fetchall(
+                    "UPDATE users SET total_referrals = total_referrals + ? "
+                    f"WHERE id IN ({_placeholders(len(chunk))}) "
+                    "RETURNING id, username, balance, total_referrals",
+                    (count, *chunk),
+                )
+                updated.extend(rows)
+        db.on_commit(lambda: _cache_users(resolved))
+    return updated
+
+
+@_timed
 async def get_invite_link_for_user(
-    db: aiosqlite.Connection, user_id: int
+    db: Connection, user_id: int
 ) -> str | None:
     row = await db.execute_fetchone(
         "SELECT invite_link FROM invite_links WHERE user_id = ?", (user_id,)
@@ -80,19 +276,64 @@ async def get_invite_link_for_user(
     return row["invite_link"] if row else None
 
 
-async def save_invite_link(
-    db: aiosqlite.Connection, user_id: int, invite_link: str
+@_timed
+async def save_invite_links(
+    db: Connection, items: Sequence[tuple[int, str]]
 ) -> None:
-    await db.execute(
-        "INSERT OR REPLACE INTO invite_links (user_id, invite_link, created_at) "
-        "VALUES (?, ?, ?)",
-        (user_id, invite_link, int(time.time())),
-    )
-    await db.commit()
+    if not items:
+        return
+    now_ts = int(time.time())
+    async with uow(db):
+        await db.executemany(
+            "INSERT OR REPLACE INTO invite_links (user_id, invite_link, created_at) "
+            "VALUES (?, ?, ?)",
+            [(user_id, invite_link, now_ts) for user_id, invite_link in items],
+        )
+
+
+@_timed
+async def add_pooled_invite_links(
+    db: Connection, invite_links: Sequence[str]
+) -> None:
+    if not invite_links:
+        return
+    now_ts = int(time.time())
+    async with uow(db):
+        await db.executemany(
+            "INSERT OR IGNORE INTO invite_link_pool (invite_link, created_at) VALUES (?, ?)",
+            [(invite_link, now_ts) for invite_link in invite_links],
+        )
+
+
+@_timed
+async def count_pooled_invite_links(db: Connection) -> int:
+    row = await db.execute_fetchone("SELECT COUNT(*) AS cnt FROM invite_link_pool")
+    return int(row["cnt"]) if row else 0
 
 
+@_timed
+async def claim_pooled_invite_link(
+    db: Connection, user_id: int
+) -> str | None:
+    async with uow(db):
+        row = await db.execute_fetchone(
+            "DELETE FROM invite_link_pool WHERE invite_link = "
+            "(SELECT invite_link FROM invite_link_pool ORDER BY created_at LIMIT 1) "
+            "RETURNING invite_link"
+        )
+        if row is None:
+            return None
+        invite_link = row["invite_link"]
+        await db.execute(
+            "INSERT INTO invite_links (user_id, invite_link, created_at) VALUES (?, ?, ?)",
+            (user_id, invite_link, int(time.time())),
+        )
+    return invite_link
+
+
+@_timed
 async def get_inviter_by_invite_link(
-    db: aiosqlite.Connection, invite_link: str
+    db: Connection, invite_link: str
 ) -> int | None:
     row = await db.execute_fetchone(
         "SELECT user_id FROM invite_links WHERE invite_link = ?", (invite_link,)
@@ -100,86 +341,305 @@ async def get_inviter_by_invite_link(
     return int(row["user_id"]) if row else None
 
 
-async def can_count_message(
-    db: aiosqlite.Connection, user_id: int, now_ts: int
-) -> bool:
-    row = await db.execute_fetchone(
-        "SELECT last_message_time, counted_messages FROM messages WHERE user_id = ?",
-        (user_id,),
+@_timed
+async def get_recent_message_times(
+    db: Connection, since_ts: int
+) -> list[tuple[int, int]]:
+    rows = await db.execute_fetchall(
+        "SELECT user_id, last_message_time FROM messages WHERE last_message_time >= ?",
+        (since_ts,),
     )
-    if row is None:
-        await db.execute(
-            "INSERT INTO messages (user_id, last_message_time, counted_messages) "
-            "VALUES (?, ?, 1)",
-            (user_id, now_ts),
+    return [(int(row["user_id"]), int(row["last_message_time"])) for row in rows]
+
+
+@_timed
+async def apply_message_batch(
+    db: Connection,
+    events: Sequence[tuple[int, str | None, int]],
+    reward: int,
+) -> tuple[int, list[aiosqlite.Row]]:
+    if not events:
+        return 0, []
+
+    usernames: dict[int, str | None] = {}
+    for user_id, username, _ in events:
+        if username or user_id not in usernames:
+            usernames[user_id] = username
+
+    inviters: dict[int, int] = {}
+    unknown: list[int] = []
+    stale: list[tuple[int, str | None]] = []
+    for user_id, username in usernames.items():
+        cached = user_cache.get(user_id)
+        if cached is None:
+            unknown.append(user_id)
+            stale.append((user_id, username))
+            continue
+        if username and cached.username != username:
+            stale.append((user_id, username))
+        if cached.invited_by is not None and cached.invited_by != user_id:
+            inviters[user_id] = cached.invited_by
+
+    async with uow(db):
+        if stale:
+            await db.executemany(
+                "INSERT INTO users (id, username, balance, invited_by, total_referrals, total_referral_messages) "
+                "VALUES (?, ?, 0, NULL, 0, 0) "
+                "ON CONFLICT(id) DO UPDATE SET username = excluded.username "
+                "WHERE excluded.username IS NOT NULL AND users.username IS NOT excluded.username",
+                stale,
+            )
+
+        resolved: dict[int, tuple[str | None, int | None]] = {}
+        for chunk in _chunks(unknown):
+            rows = await db.execute_fetchall(
+                f"SELECT id, username, invited_by FROM users WHERE id IN ({_placeholders(len(chunk))})",
+                chunk,
+            )
+            for row in rows:
+                user_id = int(row["id"])
+                invited_by = row["invited_by"]
+                resolved[user_id] = (row["username"], invited_by)
+                if invited_by is not None and invited_by != user_id:
+                    inviters[user_id] = int(invited_by)
+
+        counted: dict[int, int] = defaultdict(int)
+        last_times: dict[int, int] = {}
+        credited: dict[int, int] = defaultdict(int)
+        for user_id, _, timestamp in events:
+            inviter_id = inviters.get(user_id)
+            if inviter_id is None:
+                continue
+            counted[user_id] += 1
+            last_times[user_id] = max(timestamp, last_times.get(user_id, timestamp))
+            credited[inviter_id] += 1
+
+        db.on_commit(lambda: _cache_batch_users(usernames, resolved))
+        if not counted:
+            return 0, []
+
+        await db.executemany(
+            "INSERT INTO messages (user_id, last_message_time, counted_messages) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET last_message_time = excluded.last_message_time, "
+            "counted_messages = counted_messages + excluded.counted_messages",
+            [(user_id, last_times[user_id], count) for user_id, count in counted.items()],
         )
-        await db.commit()
-        return True
 
-    if now_ts - int(row["last_message_time"]) < 10:
-        return False
-
-    await db.execute(
-        "UPDATE messages SET last_message_time = ?, counted_messages = counted_messages + 1 "
-        "WHERE user_id = ?",
-        (now_ts, user_id),
-    )
-    await db.commit()
-    return True
-
-
-async def increment_inviter_for_message(
-    db: aiosqlite.Connection, inviter_id: int, reward: float
+        by_count: dict[int, list[int]] = defaultdict(list)
+        for inviter_id, count in credited.items():
+            by_count[count].append(inviter_id)
+        updated: list[aiosqlite.Row] = []
+        for count, inviter_ids in by_count.items():
+            for chunk in _chunks(inviter_ids):
+                rows = await db.execute_fetchall(
+                    "UPDATE users SET balance = balance + ?, "
+                    "total_referral_messages = total_referral_messages + ? "
+                    f"WHERE id IN ({_placeholders(len(chunk))}) "
+                    "RETURNING id, username, balance, total_referrals",
+                    (reward * count, count, *chunk),
+                )
+                updated.extend(rows)
+    return sum(counted.values()), updated
+
+
+def _cache_users(resolved: dict[int, tuple[str | None, int | None]]) -> None:
+    for user_id, (username, invited_by) in resolved.items():
+        user_cache.put(user_id, username, invited_by)
+
+
+def _cache_batch_users(
+    usernames: dict[int, str | None],
+    resolved: dict[int, tuple[str | None, int | None]],
 ) -> None:
-    await db.execute(
-        "UPDATE users SET balance = balance + ?, total_referral_messages = total_referral_messages + 1 "
-        "WHERE id = ?",
-        (reward, inviter_id),
-    )
-    await db.commit()
+    for user_id, (username, invited_by) in resolved.items():
+        user_cache.put(user_id, usernames[user_id] or username, invited_by)
+    for user_id, username in usernames.items():
+        if user_id not in resolved and username:
+            user_cache.set_username(user_id, username)
 
 
+@_timed
 async def get_top_users(
-    db: aiosqlite.Connection, limit: int = 10
+    db: Connection,
+    limit: int = 10,
+    after: tuple[int, int, int] | None = None,
 ) -> list[aiosqlite.Row]:
+    if after is None:
+        rows = await db.execute_fetchall(
+            "SELECT id, username, balance, total_referrals FROM users "
+            "ORDER BY balance DESC, total_referrals DESC, id LIMIT ?",
+            (limit,),
+        )
+        return list(rows)
+
+    balance, total_referrals, user_id = after
     rows = await db.execute_fetchall(
-        "SELECT * FROM users ORDER BY balance DESC, total_referrals DESC LIMIT ?",
-        (limit,),
+        "SELECT id, username, balance, total_referrals FROM users "
+        "WHERE balance <= ? AND (balance < ? OR total_referrals < ? "
+        "OR (total_referrals = ? AND id > ?)) "
+        "ORDER BY balance DESC, total_referrals DESC, id LIMIT ?",
+        (balance, balance, total_referrals, total_referrals, user_id, limit),
     )
     return list(rows)
 
 
-async def get_totals(db: aiosqlite.Connection) -> dict[str, Any]:
-    users_row = await db.execute_fetchone("SELECT COUNT(*) AS cnt FROM users")
-    referrals_row = await db.execute_fetchone("SELECT COUNT(*) AS cnt FROM referrals")
-    exchanges_row = await db.execute_fetchone("SELECT COUNT(*) AS cnt FROM exchanges")
-    balance_row = await db.execute_fetchone("SELECT COALESCE(SUM(balance), 0) AS total FROM users")
+async def iter_rank_rows(
+    db: Connection, by_id: bool = False
+) -> AsyncIterator[list[aiosqlite.Row]]:
+    order = "id" if by_id else "balance DESC, total_referrals DESC, id"
+    async with db.execute(
+        f"SELECT id, balance, total_referrals FROM users ORDER BY {order}"
+    ) as cursor:
+        while True:
+            rows = await cursor.fetchmany(_RANK_FETCH_SIZE)
+            if not rows:
+                return
+            yield list(rows)
+
+
+@_timed
+async def get_users_by_ids(
+    db: Connection, user_ids: Sequence[int]
+) -> list[aiosqlite.Row]:
+    result: list[aiosqlite.Row] = []
+    for chunk in _chunks(user_ids):
+        rows = await db.execute_fetchall(
+            "SELECT id, username, balance, total_referrals FROM users "
+            f"WHERE id IN ({_placeholders(len(chunk))})",
+            chunk,
+        )
+        result.extend(rows)
+    return result
+
+
+@_timed
+async def get_totals(db: Connection) -> dict[str, Any]:
+    row = await db.execute_fetchone(
+        "SELECT users, referrals, exchanges, total_balance FROM stats_counters WHERE id = 1"
+    )
     return {
-        "users": int(users_row["cnt"]) if users_row else 0,
-        "referrals": int(referrals_row["cnt"]) if referrals_row else 0,
-        "exchanges": int(exchanges_row["cnt"]) if exchanges_row else 0,
-        "total_balance": float(balance_row["total"]) if balance_row else 0.0,
+        "users": int(row["users"]) if row else 0,
+        "referrals": int(row["referrals"]) if row else 0,
+        "exchanges": int(row["exchanges"]) if row else 0,
+        "total_balance": int(row["total_balance"]) if row else 0,
     }
 
 
-async def try_exchange(
-    db: aiosqlite.Connection, user_id: int, amount: float, steam_link: str
-) -> bool:
-    await db.execute("BEGIN IMMEDIATE")
-    row = await db.execute_fetchone("SELECT balance FROM users WHERE id = ?", (user_id,))
-    if row is None:
-        await db.execute("ROLLBACK")
-        return False
-    if float(row["balance"]) < amount:
-        await db.execute("ROLLBACK")
-        return False
+@_timed
+async def reconcile_totals(db: Connection) -> dict[str, tuple[Any, Any]]:
+    async with uow(db):
+        actual = await db.execute_fetchone(
+            "SELECT "
+            "(SELECT COUNT(*) FROM users) AS users, "
+            "(SELECT COUNT(*) FROM referrals) AS referrals, "
+            "(SELECT COUNT(*) FROM exchanges) AS exchanges, "
+            "(SELECT COALESCE(SUM(balance), 0) FROM users) AS total_balance"
+        )
+        stored = await get_totals(db)
+        expected = {
+            "users": int(actual["users"]),
+            "referrals": int(actual["referrals"]),
+            "exchanges": int(actual["exchanges"]),
+            "total_balance": int(actual["total_balance"]),
+        }
+        drift: dict[str, tuple[Any, Any]] = {}
+        for key, value in expected.items():
+            if stored[key] != value:
+                drift[key] = (stored[key], value)
 
-    await db.execute(
-        "UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id)
+        await db.execute(
+            "INSERT INTO stats_counters (id, users, referrals, exchanges, total_balance) "
+            "VALUES (1, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET users = excluded.users, referrals = excluded.referrals, "
+            "exchanges = excluded.exchanges, total_balance = excluded.total_balance",
+            (
+                expected["users"],
+                expected["referrals"],
+                expected["exchanges"],
+                expected["total_balance"],
+            ),
+        )
+    return drift
+
+
+@_timed
+async def try_exchange(
+    db: Connection,
+    user_id: int,
+    amount: int,
+    steam_link: str,
+    notifications: Sequence[tuple[int, str]] = (),
+) -> aiosqlite.Row | None:
+    async with uow(db):
+        updated = await db.execute_fetchone(
+            "UPDATE users SET balance = balance - ? WHERE id = ? AND balance >= ? "
+            "RETURNING id, username, balance, total_referrals",
+            (amount, user_id, amount),
+        )
+        if updated is None:
+            return None
+        now_ts = int(time.time())
+        await db.execute(
+            "INSERT INTO exchanges (user_id, amount, steam_link, timestamp) VALUES (?, ?, ?, ?)",
+            (user_id, amount, steam_link, now_ts),
+        )
+        if notifications:
+            await db.executemany(
+                "INSERT INTO notification_outbox (chat_id, text, created_at, next_attempt_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(chat_id, text, now_ts, now_ts) for chat_id, text in notifications],
+            )
+    return updated
+
+
+@_timed
+async def claim_due_notifications(
+    db: Connection, now_ts: int, lease: int, limit: int
+) -> list[aiosqlite.Row]:
+    rows = await db.execute_fetchall(
+        "UPDATE notification_outbox SET next_attempt_at = ? WHERE id IN ("
+        "SELECT id FROM notification_outbox "
+        "WHERE sent_at IS NULL AND failed_at IS NULL AND next_attempt_at <= ? "
+        "ORDER BY next_attempt_at LIMIT ?"
+        ") RETURNING id, chat_id, text, attempts",
+        (now_ts + lease, now_ts, limit),
     )
-    await db.execute(
-        "INSERT INTO exchanges (user_id, amount, steam_link, timestamp) VALUES (?, ?, ?, ?)",
-        (user_id, amount, steam_link, int(time.time())),
+    return list(rows)
+
+
+@_timed
+async def next_notification_due(db: Connection) -> int | None:
+    row = await db.execute_fetchone(
+        "SELECT MIN(next_attempt_at) AS due FROM notification_outbox "
+        "WHERE sent_at IS NULL AND failed_at IS NULL"
     )
-    await db.commit()
-    return True
+    return int(row["due"]) if row and row["due"] is not None else None
+
+
+@_timed
+async def record_notification_results(
+    db: Connection,
+    sent_ids: Sequence[int],
+    retries: Sequence[tuple[int, int, str]],
+    failures: Sequence[tuple[int, str]],
+) -> None:
+    now_ts = int(time.time())
+    async with uow(db):
+        for chunk in _chunks(sent_ids):
+            await db.execute(
+                "UPDATE notification_outbox SET sent_at = ?, attempts = attempts + 1 "
+                f"WHERE id IN ({_placeholders(len(chunk))})",
+                (now_ts, *chunk),
+            )
+        if retries:
+            await db.executemany(
+                "UPDATE notification_outbox SET attempts = attempts + 1, next_attempt_at = ?, "
+                "last_error = ? WHERE id = ?",
+                [(next_at, error, notification_id) for notification_id, next_at, error in retries],
+            )
+        if failures:
+            await db.executemany(
+                "UPDATE notification_outbox SET attempts = attempts + 1, failed_at = ?, "
+                "last_error = ? WHERE id = ?",
+                [(now_ts, error, notification_id) for notification_id, error in failures],
+            )
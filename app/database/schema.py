@@ -1,21 +1,95 @@
 from __future__ import annotations
 
-import aiosqlite
+from app.database.db import Connection
+from app.database.migrations import Migration, apply_migrations
+from app.services.money import UNITS_PER_PAPPY
 
+_USERS_TABLE = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        balance INTEGER NOT NULL DEFAULT 0,
+        invited_by INTEGER,
+        total_referrals INTEGER DEFAULT 0,
+        total_referral_messages INTEGER DEFAULT 0
+    )
+"""
 
-async def init_db(db: aiosqlite.Connection) -> None:
-    await db.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            username TEXT,
-            balance REAL DEFAULT 0,
-            invited_by INTEGER,
-            total_referrals INTEGER DEFAULT 0,
-            total_referral_messages INTEGER DEFAULT 0
-        )
-        """
+_EXCHANGES_TABLE = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        steam_link TEXT NOT NULL,
+        timestamp INTEGER NOT NULL
+    )
+"""
+
+_STATS_TABLE = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        users INTEGER NOT NULL DEFAULT 0,
+        referrals INTEGER NOT NULL DEFAULT 0,
+        exchanges INTEGER NOT NULL DEFAULT 0,
+        total_balance INTEGER NOT NULL DEFAULT 0
     )
+"""
+
+_STATS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_stats_users_insert AFTER INSERT ON users
+    BEGIN
+        UPDATE stats_counters
+        SET users = users + 1, total_balance = total_balance + COALESCE(NEW.balance, 0)
+        WHERE id = 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_stats_users_delete AFTER DELETE ON users
+    BEGIN
+        UPDATE stats_counters
+        SET users = users - 1, total_balance = total_balance - COALESCE(OLD.balance, 0)
+        WHERE id = 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_stats_users_balance AFTER UPDATE OF balance ON users
+    WHEN NEW.balance IS NOT OLD.balance
+    BEGIN
+        UPDATE stats_counters
+        SET total_balance = total_balance + COALESCE(NEW.balance, 0) - COALESCE(OLD.balance, 0)
+        WHERE id = 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_stats_referrals_insert AFTER INSERT ON referrals
+    BEGIN
+        UPDATE stats_counters SET referrals = referrals + 1 WHERE id = 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_stats_referrals_delete AFTER DELETE ON referrals
+    BEGIN
+        UPDATE stats_counters SET referrals = referrals - 1 WHERE id = 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_stats_exchanges_insert AFTER INSERT ON exchanges
+    BEGIN
+        UPDATE stats_counters SET exchanges = exchanges + 1 WHERE id = 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_stats_exchanges_delete AFTER DELETE ON exchanges
+    BEGIN
+        UPDATE stats_counters SET exchanges = exchanges - 1 WHERE id = 1;
+    END
+    """,
+)
+
+
+async def _create_tables(db: Connection) -> None:
+    await db.execute(_USERS_TABLE.format(table="users"))
     await db.execute(
         """
         CREATE TABLE IF NOT EXISTS referrals (
@@ -35,33 +109,61 @@ async def init_db(db: aiosqlite.Connection) -> None:
         )
         """
     )
+    await db.execute(_EXCHANGES_TABLE.format(table="exchanges"))
     await db.execute(
         """
-        CREATE TABLE IF NOT EXISTS exchanges (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            amount REAL NOT NULL,
-            steam_link TEXT NOT NULL,
-            timestamp INTEGER NOT NULL
+        CREATE TABLE IF NOT EXISTS invite_links (
+            user_id INTEGER PRIMARY KEY,
+            invite_link TEXT NOT NULL UNIQUE,
+            created_at INTEGER NOT NULL
         )
         """
     )
+
     await db.execute(
         """
-        CREATE TABLE IF NOT EXISTS invite_links (
-            user_id INTEGER PRIMARY KEY,
-            invite_link TEXT NOT NULL UNIQUE,
+        CREATE TABLE IF NOT EXISTS invite_link_pool (
+            invite_link TEXT PRIMARY KEY,
             created_at INTEGER NOT NULL
         )
         """
     )
-
     await db.execute(
-        "CREATE INDEX IF NOT EXISTS idx_users_balance ON users(balance DESC)"
+        """
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL,
+            sent_at INTEGER,
+            failed_at INTEGER,
+            last_error TEXT
+        )
+        """
     )
+    await db.execute(_STATS_TABLE.format(table="stats_counters"))
+
+
+async def _create_stats_counters(db: Connection) -> None:
     await db.execute(
-        "CREATE INDEX IF NOT EXISTS idx_users_referrals ON users(total_referrals DESC)"
+        """
+        INSERT INTO stats_counters (id, users, referrals, exchanges, total_balance)
+        SELECT
+            1,
+            (SELECT COUNT(*) FROM users),
+            (SELECT COUNT(*) FROM referrals),
+            (SELECT COUNT(*) FROM exchanges),
+            (SELECT COALESCE(SUM(balance), 0) FROM users)
+        WHERE NOT EXISTS (SELECT 1 FROM stats_counters)
+        """
     )
+    for trigger in _STATS_TRIGGERS:
+        await db.execute(trigger)
+
+
+async def _create_indexes(db: Connection) -> None:
     await db.execute(
         "CREATE INDEX IF NOT EXISTS idx_referrals_inviter ON referrals(inviter_id)"
     )
@@ -69,6 +171,97 @@ async def init_db(db: aiosqlite.Connection) -> None:
         "CREATE INDEX IF NOT EXISTS idx_exchanges_user ON exchanges(user_id)"
     )
     await db.execute(
-        "CREATE INDEX IF NOT EXISTS idx_invite_links_link ON invite_links(invite_link)"
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON notification_outbox(next_attempt_at) "
+        "WHERE sent_at IS NULL AND failed_at IS NULL"
+    )
+
+
+async def _column_type(db: Connection, table: str, column: str) -> str | None:
+    for row in await db.execute_fetchall(f"PRAGMA table_info({table})"):
+        if row["name"] == column:
+            return str(row["type"]).upper()
+    return None
+
+
+async def _rebuild_table(
+    db: Connection, table: str, ddl: str, select_columns: str
+) -> None:
+    rebuilt = f"{table}_rebuilt"
+    await db.execute(f"DROP TABLE IF EXISTS {rebuilt}")
+    await db.execute(ddl.format(table=rebuilt))
+    await db.execute(f"INSERT INTO {rebuilt} SELECT {select_columns} FROM {table}")
+    await db.execute(f"DROP TABLE {table}")
+    await db.execute(f"ALTER TABLE {rebuilt} RENAME TO {table}")
+
+
+async def _migrate_integer_balances(db: Connection) -> None:
+    pending = [
+        await _column_type(db, "users", "balance"),
+        await _column_type(db, "exchanges", "amount"),
+        await _column_type(db, "stats_counters", "total_balance"),
+    ]
+    if "REAL" not in pending:
+        return
+
+    triggers = await db.execute_fetchall(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_stats_%'"
     )
-    await db.commit()
+    for row in triggers:
+        await db.execute(f"DROP TRIGGER {row['name']}")
+
+    to_units = f"CAST(ROUND(COALESCE({{column}}, 0) * {UNITS_PER_PAPPY}) AS INTEGER)"
+    if pending[0] == "REAL":
+        await _rebuild_table(
+            db,
+            "users",
+            _USERS_TABLE,
+            f"id, username, {to_units.format(column='balance')}, invited_by, "
+            "total_referrals, total_referral_messages",
+        )
+    if pending[1] == "REAL":
+        await _rebuild_table(
+            db,
+            "exchanges",
+            _EXCHANGES_TABLE,
+            f"id, user_id, {to_units.format(column='amount')}, steam_link, timestamp",
+        )
+    if pending[2] == "REAL":
+        await _rebuild_table(
+            db,
+            "stats_counters",
+            _STATS_TABLE,
+            "id, users, referrals, exchanges, "
+            "(SELECT COALESCE(SUM(balance), 0) FROM users)",
+        )
+
+
+async def _replace_leaderboard_indexes(db: Connection) -> None:
+    await db.execute("DROP INDEX IF EXISTS idx_invite_links_link")
+    await db.execute("DROP INDEX IF EXISTS idx_users_balance")
+    await db.execute("DROP INDEX IF EXISTS idx_users_referrals")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_leaderboard "
+        "ON users(balance DESC, total_referrals DESC, id)"
+    )
+
+
+async def _cover_leaderboard_index(db: Connection) -> None:
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_leaderboard_cover "
+        "ON users(balance DESC, total_referrals DESC, id, username)"
+    )
+    await db.execute("DROP INDEX IF EXISTS idx_users_leaderboard")
+
+
+MIGRATIONS = (
+    Migration(1, "create_tables", _create_tables),
+    Migration(2, "integer_balances", _migrate_integer_balances),
+    Migration(3, "stats_counters", _create_stats_counters),
+    Migration(4, "indexes", _create_indexes),
+    Migration(5, "leaderboard_index", _replace_leaderboard_indexes),
+    Migration(6, "leaderboard_cover_index", _cover_leaderboard_index),
+)
+
+
+async def init_db(db: Connection) -> None:
+    await apply_migrations(db, MIGRATIONS)
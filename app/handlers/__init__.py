@@ -1,9 +1,13 @@
+from aiogram import Dispatcher
+
+from app.config import Config
 from app.handlers.start import router as start_router
 from app.handlers.profile import router as profile_router
 from app.handlers.top import router as top_router
 from app.handlers.admin import router as admin_router
 from app.handlers.group import router as group_router
 from app.handlers.utils import router as utils_router
+from app.services.scheduler import handler_latency, update_scheduler
 
 
 def setup_routers() -> list:
@@ -15,3 +19,14 @@ def setup_routers() -> list:
         group_router,
         utils_router,
     ]
+
+
+def build_dispatcher(config: Config) -> Dispatcher:
+    dp = Dispatcher(config=config)
+    dp.update.outer_middleware(update_scheduler)
+    for name, observer in dp.observers.items():
+        if name not in {"update", "error"}:
+            observer.middleware(handler_latency)
+    for router in setup_routers():
+        dp.include_router(router)
+    return dp
@@ -4,25 +4,26 @@ from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
 
-from app.config import load_config
-from app.database.db import get_db
-from app.database.queries import get_totals
+from app.config import Config
+from app.database.db import get_db, get_read_db, pool_stats
+from app.database.queries import get_totals, reconcile_totals
+from app.services.money import format_pappy
+from app.services.scheduler import handler_latency, update_scheduler
 
 router = Router()
-_config = load_config()
 
 
 @router.message(Command("admin_stats"))
-async def cmd_admin_stats(message: Message) -> None:
+async def cmd_admin_stats(message: Message, config: Config) -> None:
     if message.chat.type != "private":
         return
 
     user = message.from_user
-    if not user or user.id not in _config.admin_ids:
+    if not user or user.id not in config.admin_ids:
         await message.answer("Недостаточно прав.")
         return
 
-    async with get_db() as db:
+    async with get_read_db() as db:
         totals = await get_totals(db)
 
     text = (
@@ -30,6 +31,64 @@ async def cmd_admin_stats(message: Message) -> None:
         f"Пользователей: {totals['users']}\n"
         f"Рефералов: {totals['referrals']}\n"
         f"Обменов: {totals['exchanges']}\n"
-        f"Суммарный баланс: {totals['total_balance']:.2f} Pappy"
+        f"Суммарный баланс: {format_pappy(totals['total_balance'])} Pappy"
     )
+
+    stats = pool_stats()
+    writes = stats.get("writes")
+    if writes:
+        text += (
+            "\n\nЗапись в базу\n\n"
+            f"Коммитов: {writes['commits']}\n"
+            f"Средний коммит: {writes['avg_commit_seconds'] * 1000:.1f} мс, "
+            f"максимум: {writes['max_commit_seconds'] * 1000:.1f} мс\n"
+            f"Повторов из-за блокировки: {writes['busy_retries']}"
+        )
+    single_writer = stats.get("single_writer")
+    if single_writer:
+        text += (
+            f"\nОчередь записи: {single_writer['queue_depth']} "
+            f"(максимум {single_writer['max_queue_depth']})\n"
+            f"Команд на коммит: {single_writer['avg_batch_size']}"
+        )
+
+    scheduler = update_scheduler.stats()
+    if scheduler["workers"]:
+        text += (
+            "\n\nОбработка обновлений\n\n"
+            f"В очереди: {scheduler['pending']} (максимум {scheduler['max_seen_pending']} "
+            f"из {scheduler['max_pending']}), обработано: {scheduler['processed']}"
+        )
+    for (name,), histogram in sorted(handler_latency.family.children.items()):
+        latency = histogram.as_dict()
+        text += (
+            f"\n{name}: {latency['count']} раз, p50 ≤ {latency['p50'] * 1000:.0f} мс, "
+            f"p99 ≤ {latency['p99'] * 1000:.0f} мс"
+        )
     await message.answer(text)
+
+
+@router.message(Command("admin_reconcile"))
+async def cmd_admin_reconcile(message: Message, config: Config) -> None:
+    if message.chat.type != "private":
+        return
+
+    user = message.from_user
+    if not user or user.id not in config.admin_ids:
+        await message.answer("Недостаточно прав.")
+        return
+
+    async with get_db() as db:
+        drift = await reconcile_totals(db)
+
+    if not drift:
+        await message.answer("Счётчики статистики совпадают с данными.")
+        return
+
+    lines = ["Счётчики статистики пересчитаны:\n"]
+    for key, (stored, actual) in drift.items():
+        if key == "total_balance":
+            stored = f"{format_pappy(stored)} Pappy"
+            actual = f"{format_pappy(actual)} Pappy"
+        lines.append(f"{key}: было {stored}, стало {actual}")
+    await message.answer("\n".join(lines))
@@ -3,60 +3,44 @@ from __future__ import annotations
 import time
 
 from aiogram import F, Router
-from aiogram.types import Message
+from aiogram.filters import IS_MEMBER, IS_NOT_MEMBER, ChatMemberUpdatedFilter
+from aiogram.types import Chat, ChatMemberUpdated, Message
 
-from app.config import load_config
+from app.config import Config
 from app.database.db import get_db
-from app.database.queries import (
-    add_referral,
-    can_count_message,
-    ensure_user,
-    get_inviter_by_invite_link,
-    get_user,
-    increment_inviter_for_message,
-    set_invited_by,
-)
+from app.database.queries import register_joins
+from app.services.cooldown import cooldown_tracker
+from app.services.ingest import MessageEvent, message_ingest
+from app.services.leaderboard import leaderboard
+from app.services.ranking import rank_index
 
 router = Router()
-_config = load_config()
-_MESSAGE_REWARD = 0.02
 
 
-def _is_target_group(message: Message) -> bool:
-    if message.chat.type not in ("group", "supergroup"):
+def _is_target_group(chat: Chat, config: Config) -> bool:
+    if chat.type not in ("group", "supergroup"):
         return False
-    if _config.group_id is None:
+    if config.group_id is None:
         return False
-    return message.chat.id == _config.group_id
+    return chat.id == config.group_id
 
 
-@router.message(F.new_chat_members)
-async def handle_new_members(message: Message) -> None:
-    if not _is_target_group(message):
+@router.chat_member(ChatMemberUpdatedFilter(IS_NOT_MEMBER >> IS_MEMBER))
+async def handle_member_joined(event: ChatMemberUpdated, config: Config) -> None:
+    if not _is_target_group(event.chat, config):
         return
 
-    invite_link = message.invite_link.invite_link if message.invite_link else None
+    member = event.new_chat_member.user
+    invite_link = event.invite_link.invite_link if event.invite_link else None
     async with get_db() as db:
-        for member in message.new_chat_members:
-            await ensure_user(db, member.id, member.username)
-            if invite_link:
-                inviter_id = await get_inviter_by_invite_link(db, invite_link)
-                if inviter_id and inviter_id != member.id:
-                    assigned = await set_invited_by(db, member.id, inviter_id)
-                    if assigned:
-                        await add_referral(db, inviter_id, member.id)
-            row = await get_user(db, member.id)
-            if not row:
-                continue
-            inviter_id = row["invited_by"]
-            if inviter_id is None or inviter_id == member.id:
-                continue
-            await add_referral(db, int(inviter_id), member.id)
+        inviters = await register_joins(db, [(member.id, member.username)], invite_link)
+    leaderboard.observe_many(inviters)
+    rank_index.observe_many(inviters)
 
 
 @router.message(F.text)
-async def handle_group_text(message: Message) -> None:
-    if not _is_target_group(message):
+async def handle_group_text(message: Message, config: Config) -> None:
+    if not _is_target_group(message.chat, config):
         return
 
     user = message.from_user
@@ -64,20 +48,13 @@ async def handle_group_text(message: Message) -> None:
         return
 
     text = message.text.strip()
-    if len(text) <= 5:
+    if len(text) < config.message_min_length:
         return
 
-    async with get_db() as db:
-        await ensure_user(db, user.id, user.username)
-        row = await get_user(db, user.id)
-        if not row:
-            return
-        inviter_id = row["invited_by"]
-        if inviter_id is None or inviter_id == user.id:
-            return
-
-        now_ts = int(time.time())
-        if not await can_count_message(db, user.id, now_ts):
-            return
+    now_ts = int(time.time())
+    if not cooldown_tracker.hit(user.id, now_ts):
+        return
 
-        await increment_inviter_for_message(db, int(inviter_id), _MESSAGE_REWARD)
+    await message_ingest.submit(
+        MessageEvent(user_id=user.id, username=user.username, timestamp=now_ts)
+    )
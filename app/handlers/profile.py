@@ -1,20 +1,20 @@
 from __future__ import annotations
 
-from aiogram import Bot, Router
+from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
 
-from app.config import load_config
-from app.database.db import get_db
-from app.database.queries import ensure_user, get_user
+from app.database.db import get_db, get_read_db
+from app.database.queries import ensure_user, get_current_user
+from app.services.identity import bot_identity
 from app.services.levels import get_level
+from app.services.money import format_pappy
 
 router = Router()
-_config = load_config()
 
 
 @router.message(Command("profile"))
-async def cmd_profile(message: Message, bot: Bot) -> None:
+async def cmd_profile(message: Message) -> None:
     if message.chat.type != "private":
         return
 
@@ -22,25 +22,21 @@ async def cmd_profile(message: Message, bot: Bot) -> None:
     if not user:
         return
 
-    async with get_db() as db:
-        await ensure_user(db, user.id, user.username)
-        row = await get_user(db, user.id)
-
+    async with get_read_db() as db:
+        row = await get_current_user(db, user.id, user.username)
     if row is None:
-        await message.answer("Не удалось загрузить профиль.")
-        return
+        async with get_db() as db:
+            row = await ensure_user(db, user.id, user.username)
 
     total_referrals = int(row["total_referrals"])
     level = get_level(total_referrals)
-    balance = float(row["balance"])
     total_messages = int(row["total_referral_messages"])
 
-    bot_me = await bot.get_me()
-    referral_link = f"https://t.me/{bot_me.username}?start={user.id}"
+    referral_link = bot_identity.start_link(user.id) or "временно недоступна"
 
     text = (
         "Профиль\n\n"
-        f"Баланс: {balance:.2f} Pappy\n"
+        f"Баланс: {format_pappy(int(row['balance']))} Pappy\n"
         f"Приглашено: {total_referrals}\n"
         f"Уровень: {level['name']}\n"
         f"Сообщений рефералов: {total_messages}\n\n"
@@ -1,27 +1,25 @@
 from __future__ import annotations
 
-from aiogram import Bot, Router
+from aiogram import Router
 from aiogram.filters import CommandStart
 from aiogram.filters.command import CommandObject
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message, WebAppInfo
 
-from app.config import load_config
-from app.database.db import get_db
-from app.database.queries import ensure_user, get_user, set_invited_by
+from app.config import Config
+from app.database.db import get_db, get_read_db, uow
+from app.database.queries import ensure_user, get_current_user, get_user, set_invited_by
+from app.services.identity import bot_identity
 
 router = Router()
-_config = load_config()
 
 
-def _webapp_keyboard() -> InlineKeyboardMarkup:
-    if not _config.webapp_url:
-        return InlineKeyboardMarkup(inline_keyboard=[])
+def _webapp_keyboard(webapp_url: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
                 InlineKeyboardButton(
                     text="Открыть Pappy",
-                    web_app=WebAppInfo(url=_config.webapp_url),
+                    web_app=WebAppInfo(url=webapp_url),
                 )
             ]
         ]
@@ -29,7 +27,7 @@ def _webapp_keyboard() -> InlineKeyboardMarkup:
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message, command: CommandObject, bot: Bot) -> None:
+async def cmd_start(message: Message, command: CommandObject, config: Config) -> None:
     if message.chat.type != "private":
         return
 
@@ -37,21 +35,28 @@ async def cmd_start(message: Message, command: CommandObject, bot: Bot) -> None:
     if not user:
         return
 
-    async with get_db() as db:
-        await ensure_user(db, user.id, user.username)
-
+    inviter_id = None
+    if command.args:
+        try:
+            inviter_id = int(command.args)
+        except ValueError:
+            inviter_id = None
+    if inviter_id == user.id:
         inviter_id = None
-        if command.args:
-            try:
-                inviter_id = int(command.args)
-            except ValueError:
-                inviter_id = None
 
-        assigned = False
-        if inviter_id and inviter_id != user.id:
-            inviter = await get_user(db, inviter_id)
-            if inviter:
-                assigned = await set_invited_by(db, user.id, inviter_id)
+    known = None
+    if inviter_id is None:
+        async with get_read_db() as db:
+            known = await get_current_user(db, user.id, user.username)
+
+    assigned = False
+    if known is None:
+        async with get_db() as db, uow(db):
+            await ensure_user(db, user.id, user.username)
+            if inviter_id:
+                inviter = await get_user(db, inviter_id)
+                if inviter:
+                    assigned = await set_invited_by(db, user.id, inviter_id)
 
     text = (
         "Добро пожаловать в Pappy.\n\n"
@@ -60,8 +65,11 @@ async def cmd_start(message: Message, command: CommandObject, bot: Bot) -> None:
     )
     if assigned:
         text += "\n\nРеферальная привязка подтверждена."
+    referral_link = bot_identity.start_link(user.id)
+    if referral_link:
+        text += f"\n\nТвоя ссылка для приглашений: {referral_link}"
 
-    reply_markup = _webapp_keyboard() if _config.webapp_url else None
-    if not _config.webapp_url:
+    reply_markup = _webapp_keyboard(config.webapp_url) if config.webapp_url else None
+    if not config.webapp_url:
         text += "\n\nWEBAPP_URL пока не настроен."
     await message.answer(text, reply_markup=reply_markup)
@@ -4,9 +4,7 @@ from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
 
-from app.database.db import get_db
-from app.database.queries import get_top_users
-from app.services.levels import get_level
+from app.services.leaderboard import leaderboard
 
 router = Router()
 
@@ -16,19 +14,14 @@ async def cmd_top(message: Message) -> None:
     if message.chat.type != "private":
         return
 
-    async with get_db() as db:
-        rows = await get_top_users(db, limit=10)
+    items = await leaderboard.items(limit=10)
 
-    if not rows:
+    if not items:
         await message.answer("Пока нет участников в таблице лидеров.")
         return
 
     lines = ["Топ по Pappy:\n"]
-    for idx, row in enumerate(rows, start=1):
-        username = row["username"]
-        display = f"@{username}" if username else f"Пользователь {row['id']}"
-        level = get_level(int(row["total_referrals"]))
-        balance = float(row["balance"])
-        lines.append(f"{idx}. {display} — {balance:.2f} Pappy — {level['name']}")
+    for idx, item in enumerate(items, start=1):
+        lines.append(f"{idx}. {item['name']} — {item['balance']:.2f} Pappy — {item['level']}")
 
     await message.answer("\n".join(lines))
@@ -3,35 +3,66 @@ from __future__ import annotations
 import asyncio
 import logging
 
-from aiogram import Bot, Dispatcher
-from aiogram.enums import ParseMode
-
-from app.config import load_config
-from app.database.db import get_db
+from app.bot import get_bot
+from app.config import Config, get_config
+from app.database.db import close_pool, get_db, open_pool
 from app.database.schema import init_db
-from app.handlers import setup_routers
+from app.handlers import build_dispatcher
+from app.services.cooldown import cooldown_tracker
+from app.services.identity import bot_identity
+from app.services.ingest import message_ingest
+from app.services.metrics import start_exporter
+from app.services.scheduler import update_scheduler
 
 
 async def _init_database() -> None:
     async with get_db() as db:
         await init_db(db)
+    await cooldown_tracker.load()
+
+
+async def _serve_webhook(config: Config) -> None:
+    import uvicorn
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            "app.webapp_server:app",
+            host=config.webapp_host,
+            port=config.webapp_port,
+        )
+    )
+    await server.serve()
 
 
 async def main() -> None:
     logging.basicConfig(level=logging.INFO)
-    config = load_config()
-
-    await _init_database()
+    config = get_config()
+    if config.bot_mode == "webhook":
+        await _serve_webhook(config)
+        return
 
-    bot = Bot(token=config.bot_token, parse_mode=ParseMode.HTML)
-    await bot.get_me()
-    await bot.delete_webhook(drop_pending_updates=True)
+    exporter = None
+    if config.metrics_port:
+        exporter = await start_exporter(config.metrics_host, config.metrics_port)
+    await open_pool()
+    try:
+        await _init_database()
+        message_ingest.start()
 
-    dp = Dispatcher()
-    for router in setup_routers():
-        dp.include_router(router)
+        bot = get_bot()
+        await bot_identity.start(bot)
+        await bot.delete_webhook(drop_pending_updates=True)
 
-    await dp.start_polling(bot)
+        dp = build_dispatcher(config)
+        update_scheduler.start(dp)
+        await dp.start_polling(bot, handle_as_tasks=False)
+    finally:
+        await update_scheduler.stop()
+        await bot_identity.stop()
+        await message_ingest.stop()
+        await close_pool()
+        if exporter is not None:
+            await exporter.cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import time
+from typing import Iterable
+
+from app.config import get_config
+from app.database.db import get_read_db
+from app.database.queries import get_recent_message_times
+
+
+class CooldownTracker:
+    def __init__(self, window: int | None = None) -> None:
+        self._window = window
+        self._bucket = 0
+        self._current: dict[int, int] = {}
+        self._previous: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    @property
+    def window(self) -> int:
+        if self._window is None:
+            self._window = get_config().message_cooldown
+        return self._window
+
+    def _rotate(self, now_ts: int) -> None:
+        bucket = now_ts // self.window
+        if bucket <= self._bucket:
+            return
+        if bucket == self._bucket + 1:
+            self._previous = self._current
+        else:
+            self._previous = {}
+        self._current = {}
+        self._bucket = bucket
+
+    def hit(self, user_id: int, now_ts: int) -> bool:
+        if self.window <= 0:
+            return True
+        self._rotate(now_ts)
+        last_ts = self._current.get(user_id)
+        if last_ts is None:
+            last_ts = self._previous.get(user_id)
+        if last_ts is not None and now_ts - last_ts < self.window:
+            return False
+        self._current[user_id] = now_ts
+        return True
+
+    def release(self, user_id: int, timestamp: int) -> None:
+        for hits in (self._current, self._previous):
+            if hits.get(user_id) == timestamp:
+                del hits[user_id]
+
+    def seed(self, last_times: Iterable[tuple[int, int]], now_ts: int) -> None:
+        if self.window <= 0:
+            return
+        self._rotate(now_ts)
+        for user_id, last_ts in last_times:
+            if now_ts - last_ts < self.window:
+                self._current[user_id] = max(last_ts, self._current.get(user_id, last_ts))
+
+    async def load(self) -> None:
+        if self.window <= 0:
+            return
+        now_ts = int(time.time())
+        async with get_read_db() as db:
+            recent = await get_recent_message_times(db, now_ts - self.window)
+        self.seed(recent, now_ts)
+
+
+cooldown_tracker = CooldownTracker()
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+
+from app.config import get_config
+
+logger = logging.getLogger(__name__)
+
+_RETRY_SECONDS = 60.0
+
+
+class BotIdentity:
+    def __init__(
+        self, fallback_username: str | None = None, refresh_interval: float | None = None
+    ) -> None:
+        self._fallback_username = fallback_username
+        self._refresh_interval = refresh_interval
+        self._task: asyncio.Task[None] | None = None
+        self.id: int | None = None
+        self.fetched_username: str | None = None
+        self.fetched_at = 0.0
+        self.failures = 0
+
+    @property
+    def refresh_interval(self) -> float:
+        if self._refresh_interval is None:
+            self._refresh_interval = get_config().bot_identity_refresh
+        return self._refresh_interval
+
+    @property
+    def username(self) -> str | None:
+        if self.fetched_username:
+            return self.fetched_username
+        return self._fallback_username or get_config().bot_username
+
+    def start_link(self, payload: int | str) -> str | None:
+        if not self.username:
+            return None
+        return f"https://t.me/{self.username}?start={payload}"
+
+    async def refresh(self, bot: Bot) -> bool:
+        try:
+            me = await bot.get_me()
+        except Exception:
+            self.failures += 1
+            logger.warning(
+                "Не удалось получить данные бота, используем %s",
+                self.username or "ссылки без имени бота",
+                exc_info=True,
+            )
+            return False
+        self.id = me.id
+        self.fetched_username = me.username
+        self.fetched_at = time.time()
+        return True
+
+    async def start(self, bot: Bot) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        fetched = await self.refresh(bot)
+        self._task = asyncio.create_task(self._run(bot, fetched))
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self, bot: Bot, fetched: bool) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval if fetched else _RETRY_SECONDS)
+            fetched = await self.refresh(bot)
+
+
+bot_identity = BotIdentity()
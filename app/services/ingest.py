@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from app.config import get_config
+from app.database.db import get_db
+from app.database.queries import apply_message_batch
+from app.services.cooldown import cooldown_tracker
+from app.services.leaderboard import leaderboard
+from app.services.metrics import registry
+from app.services.money import to_units
+from app.services.ranking import rank_index
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_REWARD = to_units("0.02")
+_FLUSH_ATTEMPTS = 4
+_RETRY_DELAY_SECONDS = 0.5
+
+ingest_retries = registry.counter(
+    "pappy_ingest_retries_total", "Повторные попытки записать пакет сообщений."
+)
+ingest_dropped = registry.counter(
+    "pappy_ingest_dropped_events_total", "Сообщения, не записанные после всех попыток."
+)
+
+
+@dataclass(frozen=True)
+class MessageEvent:
+    user_id: int
+    username: str | None
+    timestamp: int
+
+
+class MessageIngest:
+    def __init__(
+        self,
+        flush_interval: float | None = None,
+        batch_size: int | None = None,
+        max_queue: int | None = None,
+    ) -> None:
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._max_queue = max_queue
+        self._events: asyncio.Queue[MessageEvent | None] | None = None
+        self._task: asyncio.Task[None] | None = None
+        self.flushed_batches = 0
+        self.flushed_events = 0
+        self.counted_events = 0
+        self.retries = 0
+        self.failed_events = 0
+
+    @property
+    def flush_interval(self) -> float:
+        if self._flush_interval is None:
+            self._flush_interval = get_config().ingest_flush_ms / 1000
+        return self._flush_interval
+
+    @property
+    def batch_size(self) -> int:
+        if self._batch_size is None:
+            self._batch_size = get_config().ingest_batch_size
+        return self._batch_size
+
+    @property
+    def _queue(self) -> asyncio.Queue[MessageEvent | None]:
+        if self._events is None:
+            if self._max_queue is None:
+                self._max_queue = get_config().ingest_queue_size
+            self._events = asyncio.Queue(maxsize=self._max_queue)
+        return self._events
+
+    @property
+    def pending(self) -> int:
+        return self._events.qsize() if self._events is not None else 0
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, event: MessageEvent) -> None:
+        self.start()
+        await self._queue.put(event)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        if not self._task.done():
+            await self._queue.put(None)
+            await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await self._queue.get()
+            if event is None:
+                await self._drain()
+                return
+
+            batch = [event]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is None:
+                    stopping = True
+                    break
+                batch.append(event)
+
+            await self._flush(batch)
+            if stopping:
+                await self._drain()
+                return
+
+    async def _drain(self) -> None:
+        batch: list[MessageEvent] = []
+        while not self._queue.empty():
+            event = self._queue.get_nowait()
+            if event is None:
+                continue
+            batch.append(event)
+            if len(batch) >= self.batch_size:
+                await self._flush(batch)
+                batch = []
+        if batch:
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[MessageEvent]) -> None:
+        rows = [(event.user_id, event.username, event.timestamp) for event in batch]
+        delay = _RETRY_DELAY_SECONDS
+        for attempt in range(1, _FLUSH_ATTEMPTS + 1):
+            try:
+                async with get_db() as db:
+                    counted, inviters = await apply_message_batch(db, rows, MESSAGE_REWARD)
+                break
+            except Exception:
+                if attempt == _FLUSH_ATTEMPTS:
+                    self._drop(batch)
+                    return
+                self.retries += 1
+                ingest_retries.labels().inc()
+                logger.warning(
+                    "Не удалось записать пакет из %d сообщений, попытка %d из %d",
+                    len(batch),
+                    attempt,
+                    _FLUSH_ATTEMPTS,
+                    exc_info=True,
+                )
+                await asyncio.sleep(delay)
+                delay *= 2
+        leaderboard.observe_many(inviters)
+        rank_index.observe_many(inviters)
+        self.flushed_batches += 1
+        self.flushed_events += len(batch)
+        self.counted_events += counted
+
+    def _drop(self, batch: list[MessageEvent]) -> None:
+        self.failed_events += len(batch)
+        ingest_dropped.labels().inc(len(batch))
+        for event in batch:
+            cooldown_tracker.release(event.user_id, event.timestamp)
+        logger.exception("Пакет из %d сообщений потерян после всех попыток", len(batch))
+
+
+message_ingest = MessageIngest()
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.config import get_config
+from app.database.db import get_db, get_read_db
+from app.database.queries import (
+    add_pooled_invite_links,
+    count_pooled_invite_links,
+    save_invite_links,
+)
+
+logger = logging.getLogger(__name__)
+
+_POOL_LINK_NAME = "pappy-pool"
+
+
+class InviteLinkProvisioner:
+    def __init__(
+        self, pool_size: int | None = None, rate: float | None = None, batch_size: int = 20
+    ) -> None:
+        self._pool_size = pool_size
+        self._rate = rate
+        self._batch_size = batch_size
+        self._pending: dict[int, None] = {}
+        self._wakeup = asyncio.Event()
+        self._next_call_at = 0.0
+        self._task: asyncio.Task[None] | None = None
+        self._bot: Bot | None = None
+        self._chat_id: int | None = None
+        self.created = 0
+        self.failed = 0
+
+    @property
+    def pool_size(self) -> int:
+        if self._pool_size is None:
+            self._pool_size = get_config().invite_pool_size
+        return self._pool_size
+
+    @property
+    def interval(self) -> float:
+        if self._rate is None:
+            self._rate = get_config().invite_link_rate
+        return 1 / self._rate if self._rate > 0 else 0.0
+
+    def is_pending(self, user_id: int) -> bool:
+        return user_id in self._pending
+
+    def request(self, user_id: int) -> None:
+        self._pending[user_id] = None
+        self._wakeup.set()
+
+    def start(self, bot: Bot, chat_id: int | None) -> None:
+        if chat_id is None:
+            return
+        self._bot = bot
+        self._chat_id = chat_id
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            refill_more = False
+            try:
+                await self._provision_pending()
+                refill_more = await self._refill_pool()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка при выпуске пригласительных ссылок")
+                await asyncio.sleep(5)
+            if self._pending or refill_more:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=60)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _create_link(self, name: str) -> str | None:
+        if self._bot is None or self._chat_id is None:
+            return None
+        while True:
+            delay = self._next_call_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_call_at = time.monotonic() + self.interval
+            try:
+                invite = await self._bot.create_chat_invite_link(chat_id=self._chat_id, name=name)
+            except TelegramRetryAfter as exc:
+                self._next_call_at = time.monotonic() + exc.retry_after
+                continue
+            except Exception:
+                self.failed += 1
+                logger.exception("Не удалось создать пригласительную ссылку")
+                return None
+            self.created += 1
+            return invite.invite_link
+
+    async def _provision_pending(self) -> None:
+        user_ids = list(self._pending)[: self._batch_size]
+        if not user_ids:
+            return
+        created: list[tuple[int, str]] = []
+        for user_id in user_ids:
+            invite_link = await self._create_link(f"ref-{user_id}")
+            if invite_link is not None:
+                created.append((user_id, invite_link))
+        if created:
+            async with get_db() as db:
+                await save_invite_links(db, created)
+        for user_id in user_ids:
+            self._pending.pop(user_id, None)
+
+    async def _refill_pool(self) -> bool:
+        if self.pool_size <= 0 or self._pending:
+            return False
+        async with get_read_db() as db:
+            missing = self.pool_size - await count_pooled_invite_links(db)
+        links: list[str] = []
+        for _ in range(min(missing, self._batch_size)):
+            if self._pending:
+                break
+            invite_link = await self._create_link(_POOL_LINK_NAME)
+            if invite_link is None:
+                break
+            links.append(invite_link)
+        if links:
+            async with get_db() as db:
+                await add_pooled_invite_links(db, links)
+        return len(links) == self._batch_size and missing > len(links)
+
+
+invite_provisioner = InviteLinkProvisioner()
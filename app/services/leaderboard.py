@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Mapping
+
+from app.config import get_config
+from app.database.db import get_read_db
+from app.database.queries import get_top_users
+from app.services.levels import get_level
+from app.services.money import from_units
+
+_CAPACITY = 100
+PAGE_SIZE = 20
+_INT64_MIN = -(2**63)
+_INT64_MAX = 2**63 - 1
+
+
+def display_name(user_id: int, username: str | None) -> str:
+    return f"@{username}" if username else f"Пользователь {user_id}"
+
+
+def parse_cursor(raw: str) -> tuple[int, int, int] | None:
+    parts = raw.split(",")
+    if len(parts) != 3:
+        return None
+    try:
+        balance, total_referrals, user_id = (int(part) for part in parts)
+    except ValueError:
+        return None
+    if not all(_INT64_MIN <= value <= _INT64_MAX for value in (balance, total_referrals, user_id)):
+        return None
+    return balance, total_referrals, user_id
+
+
+@dataclass(order=True)
+class LeaderboardEntry:
+    sort_key: tuple[int, int, int] = field(init=False, repr=False)
+    user_id: int = field(compare=False)
+    username: str | None = field(compare=False)
+    balance: int = field(compare=False)
+    total_referrals: int = field(compare=False)
+
+    def __post_init__(self) -> None:
+        self.sort_key = (-self.balance, -self.total_referrals, self.user_id)
+
+    def as_item(self) -> dict[str, Any]:
+        return {
+            "id": self.user_id,
+            "name": display_name(self.user_id, self.username),
+            "balance": from_units(self.balance),
+            "level": get_level(self.total_referrals)["name"],
+        }
+
+    @property
+    def cursor(self) -> str:
+        return f"{self.balance},{self.total_referrals},{self.user_id}"
+
+
+class Leaderboard:
+    def __init__(self, capacity: int, page_size: int, max_age: float | None = None) -> None:
+        self._capacity = capacity
+        self._page_size = page_size
+        self._max_age = max_age
+        self._entries: list[LeaderboardEntry] = []
+        self._by_id: dict[int, LeaderboardEntry] = {}
+        self._complete = False
+        self._dirty = True
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._items: list[dict[str, Any]] | None = None
+        self._next: str | None = None
+        self._payload: bytes | None = None
+        self._etag: str | None = None
+        self.refreshes = 0
+
+    @property
+    def max_age(self) -> float:
+        if self._max_age is None:
+            self._max_age = get_config().leaderboard_max_age
+        return self._max_age
+
+    @property
+    def cache_control(self) -> str:
+        return f"private, max-age={int(self.max_age)}"
+
+    def _is_stale(self) -> bool:
+        return self._dirty or time.monotonic() - self._loaded_at >= self.max_age
+
+    def _invalidate(self) -> None:
+        self._items = None
+        self._next = None
+        self._payload = None
+        self._etag = None
+
+    async def refresh(self) -> None:
+        async with get_read_db() as db:
+            rows = await get_top_users(db, limit=self._capacity)
+        self.load(rows)
+
+    def load(self, rows: Iterable[Mapping[str, Any]]) -> None:
+        entries = sorted(_entry_from_row(row) for row in rows)
+        self._entries = entries
+        self._by_id = {entry.user_id: entry for entry in entries}
+        self._complete = len(entries) < self._capacity
+        self._dirty = False
+        self._loaded_at = time.monotonic()
+        self._invalidate()
+        self.refreshes += 1
+
+    def observe(self, row: Mapping[str, Any]) -> None:
+        entry = _entry_from_row(row)
+        previous = self._by_id.pop(entry.user_id, None)
+        if previous is not None:
+            index = bisect.bisect_left(self._entries, previous)
+            del self._entries[index]
+        elif self._entries and not self._complete and entry >= self._entries[-1]:
+            return
+
+        if self._entries and not self._complete and entry > self._entries[-1]:
+            self._dirty = True
+            self._invalidate()
+            return
+
+        bisect.insort(self._entries, entry)
+        self._by_id[entry.user_id] = entry
+        if len(self._entries) > self._capacity:
+            dropped = self._entries.pop()
+            del self._by_id[dropped.user_id]
+            self._complete = False
+        self._invalidate()
+
+    def observe_many(self, rows: Iterable[Mapping[str, Any]]) -> None:
+        for row in rows:
+            self.observe(row)
+
+    async def _ensure_fresh(self) -> None:
+        if not self._is_stale():
+            return
+        async with self._lock:
+            if self._is_stale():
+                await self.refresh()
+
+    def _first_page(self) -> list[dict[str, Any]]:
+        if self._items is None:
+            page = self._entries[: self._page_size]
+            self._items = [entry.as_item() for entry in page]
+            has_more = len(self._entries) > len(page) or not self._complete
+            self._next = page[-1].cursor if page and has_more else None
+        return self._items
+
+    async def items(self, limit: int | None = None) -> list[dict[str, Any]]:
+        await self._ensure_fresh()
+        items = self._first_page()
+        if limit is None or limit >= len(items):
+            return list(items)
+        return items[:limit]
+
+    async def first_page(self) -> dict[str, Any]:
+        await self._ensure_fresh()
+        items = self._first_page()
+        return {"items": list(items), "next": self._next}
+
+    async def payload(self) -> tuple[bytes, str]:
+        await self._ensure_fresh()
+        if self._payload is None or self._etag is None:
+            body = {"items": self._first_page(), "next": self._next}
+            self._payload = json.dumps(body, ensure_ascii=False).encode()
+            self._etag = '"' + hashlib.sha1(self._payload).hexdigest()[:20] + '"'
+        return self._payload, self._etag
+
+    async def page_after(self, after: tuple[int, int, int]) -> dict[str, Any]:
+        async with get_read_db() as db:
+            rows = await get_top_users(db, limit=self._page_size + 1, after=after)
+        entries = [_entry_from_row(row) for row in rows[: self._page_size]]
+        has_more = len(rows) > self._page_size
+        return {
+            "items": [entry.as_item() for entry in entries],
+            "next": entries[-1].cursor if has_more else None,
+        }
+
+
+def _entry_from_row(row: Mapping[str, Any]) -> LeaderboardEntry:
+    return LeaderboardEntry(
+        user_id=int(row["id"]),
+        username=row["username"],
+        balance=int(row["balance"]),
+        total_referrals=int(row["total_referrals"]),
+    )
+
+
+leaderboard = Leaderboard(capacity=_CAPACITY, page_size=PAGE_SIZE)
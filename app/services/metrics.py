@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import bisect
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Sequence
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Gauge:
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 6) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 6),
+        }
+
+
+class MetricFamily(ABC):
+    kind = ""
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str]) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.children: dict[tuple[str, ...], Any] = {}
+
+    def _child(self, values: tuple[object, ...]) -> Any:
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name} ожидает метки {self.label_names}, получено {key}")
+            child = self.children[key] = self._new()
+        return child
+
+    @abstractmethod
+    def _new(self) -> Any: ...
+
+    @abstractmethod
+    def _render_child(self, labels: list[str], child: Any) -> list[str]: ...
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for key, child in sorted(self.children.items()):
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, key)]
+            lines.extend(self._render_child(labels, child))
+        return lines
+
+
+class CounterFamily(MetricFamily):
+    kind = "counter"
+
+    def labels(self, *values: object) -> Counter:
+        return self._child(values)
+
+    def _new(self) -> Counter:
+        return Counter()
+
+    def _render_child(self, labels: list[str], child: Counter) -> list[str]:
+        return [f"{self.name}{_format_labels(labels)} {_format_value(child.value)}"]
+
+
+class GaugeFamily(MetricFamily):
+    kind = "gauge"
+
+    def labels(self, *values: object) -> Gauge:
+        return self._child(values)
+
+    def _new(self) -> Gauge:
+        return Gauge()
+
+    def _render_child(self, labels: list[str], child: Gauge) -> list[str]:
+        return [f"{self.name}{_format_labels(labels)} {_format_value(child.value)}"]
+
+
+class HistogramFamily(MetricFamily):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: Sequence[str],
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+
+    def labels(self, *values: object) -> Histogram:
+        return self._child(values)
+
+    def _new(self) -> Histogram:
+        return Histogram(self.buckets)
+
+    def _render_child(self, labels: list[str], child: Histogram) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*child.buckets, None), child.counts):
+            cumulative += count
+            le = "+Inf" if bound is None else _format_value(bound)
+            bucket_labels = _format_labels([*labels, f'le="{le}"'])
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(child.total)}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {child.count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: list[str]) -> str:
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._families: dict[str, MetricFamily] = {}
+
+    def counter(
+        self, name: str, description: str, label_names: Sequence[str] = ()
+    ) -> CounterFamily:
+        family = CounterFamily(name, description, label_names)
+        self._families[name] = family
+        return family
+
+    def gauge(self, name: str, description: str, label_names: Sequence[str] = ()) -> GaugeFamily:
+        family = GaugeFamily(name, description, label_names)
+        self._families[name] = family
+        return family
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> HistogramFamily:
+        family = HistogramFamily(name, description, label_names, buckets)
+        self._families[name] = family
+        return family
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for family in self._families.values():
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+db_query_seconds = registry.histogram(
+    "pappy_db_query_seconds", "Время выполнения запросов к базе.", ("query",), QUERY_BUCKETS
+)
+db_query_rows = registry.counter(
+    "pappy_db_query_rows_total", "Строки, изменённые или прочитанные запросами.", ("query",)
+)
+db_checkouts = registry.counter(
+    "pappy_db_checkouts_total", "Сколько раз выдавалось соединение из пула.", ("kind",)
+)
+db_connections_opened = registry.counter(
+    "pappy_db_connections_opened_total", "Открытые соединения SQLite.", ("kind",)
+)
+db_lock_wait_seconds = registry.histogram(
+    "pappy_db_lock_wait_seconds",
+    "Ожидание соединения из пула и блокировки записи SQLite.",
+    ("lock",),
+    QUERY_BUCKETS,
+)
+db_commit_seconds = registry.histogram(
+    "pappy_db_commit_seconds", "Длительность коммитов.", (), QUERY_BUCKETS
+)
+db_busy_retries = registry.counter(
+    "pappy_db_busy_retries_total", "Повторы BEGIN IMMEDIATE из-за занятой базы."
+)
+db_write_queue_depth = registry.gauge(
+    "pappy_db_write_queue_depth", "Команды записи, ждущие единственного писателя."
+)
+db_write_batch_size = registry.histogram(
+    "pappy_db_write_batch_size", "Команды записи в одном групповом коммите.", (), BATCH_BUCKETS
+)
+db_write_commit_wait_seconds = registry.histogram(
+    "pappy_db_write_commit_wait_seconds",
+    "Ожидание группового коммита после завершения команды записи.",
+    (),
+    QUERY_BUCKETS,
+)
+handler_seconds = registry.histogram(
+    "pappy_handler_seconds", "Время работы обработчиков бота.", ("handler",)
+)
+http_request_seconds = registry.histogram(
+    "pappy_http_request_seconds",
+    "Время обработки запросов веб-сервера.",
+    ("method", "route", "status"),
+)
+
+
+async def start_exporter(host: str, port: int) -> web.AppRunner:
+    from aiohttp import web
+
+    async def metrics(_: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,18 @@
+from __future__ import annotations
+
+from decimal import ROUND_HALF_UP, Decimal
+
+UNITS_PER_PAPPY = 1_000_000
+
+
+def to_units(amount: float | int | str | Decimal) -> int:
+    scaled = Decimal(str(amount)) * UNITS_PER_PAPPY
+    return int(scaled.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_units(units: int) -> float:
+    return units / UNITS_PER_PAPPY
+
+
+def format_pappy(units: int) -> str:
+    return f"{Decimal(units) / UNITS_PER_PAPPY:.2f}"
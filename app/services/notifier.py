@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from app.config import get_config
+from app.database.db import get_db, get_read_db
+from app.database.queries import (
+    claim_due_notifications,
+    next_notification_due,
+    record_notification_results,
+)
+
+logger = logging.getLogger(__name__)
+
+_LEASE_SECONDS = 60
+_MAX_BACKOFF_SECONDS = 3600
+_IDLE_POLL_SECONDS = 30
+_ERROR_BACKOFF_SECONDS = 5
+
+
+class NotificationDispatcher:
+    def __init__(self, concurrency: int | None = None, max_attempts: int | None = None) -> None:
+        self._concurrency = concurrency
+        self._max_attempts = max_attempts
+        self._sending: asyncio.Semaphore | None = None
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._task: asyncio.Task[None] | None = None
+        self._bot: Bot | None = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def concurrency(self) -> int:
+        if self._concurrency is None:
+            self._concurrency = get_config().notify_concurrency
+        return self._concurrency
+
+    @property
+    def max_attempts(self) -> int:
+        if self._max_attempts is None:
+            self._max_attempts = get_config().notify_max_attempts
+        return self._max_attempts
+
+    @property
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._sending is None:
+            self._sending = asyncio.Semaphore(self.concurrency)
+        return self._sending
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def start(self, bot: Bot) -> None:
+        self._bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                delivered = await self._dispatch_once()
+                if not delivered:
+                    await self._sleep_until_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка при отправке уведомлений")
+                await asyncio.sleep(_ERROR_BACKOFF_SECONDS)
+
+    async def _sleep_until_due(self) -> None:
+        async with get_read_db() as db:
+            due = await next_notification_due(db)
+        timeout = float(_IDLE_POLL_SECONDS)
+        if due is not None:
+            timeout = min(max(due - time.time(), 0.0), timeout)
+        timeout = max(timeout, self._paused_until - time.monotonic())
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0.05))
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch_once(self) -> int:
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+        async with get_db() as db:
+            rows = await claim_due_notifications(
+                db, int(time.time()), _LEASE_SECONDS, self.concurrency * 4
+            )
+        if not rows:
+            return 0
+
+        results = await asyncio.gather(*(self._deliver(row) for row in rows))
+        sent_ids: list[int] = []
+        retries: list[tuple[int, int, str]] = []
+        failures: list[tuple[int, str]] = []
+        now_ts = int(time.time())
+        for row, (outcome, delay, error) in zip(rows, results):
+            notification_id = int(row["id"])
+            if outcome == "sent":
+                sent_ids.append(notification_id)
+            elif outcome == "retry" and int(row["attempts"]) + 1 < self.max_attempts:
+                retries.append((notification_id, now_ts + delay, error))
+            else:
+                failures.append((notification_id, error))
+
+        async with get_db() as db:
+            await record_notification_results(db, sent_ids, retries, failures)
+        self.sent += len(sent_ids)
+        self.retried += len(retries)
+        self.failed += len(failures)
+        for notification_id, error in failures:
+            logger.warning("Уведомление %d не доставлено: %s", notification_id, error)
+        return len(rows)
+
+    async def _deliver(self, row: Any) -> tuple[str, int, str]:
+        if self._bot is None:
+            return "retry", _LEASE_SECONDS, "бот не запущен"
+        async with self._semaphore:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                await self._bot.send_message(int(row["chat_id"]), row["text"])
+            except TelegramRetryAfter as exc:
+                self._paused_until = max(self._paused_until, time.monotonic() + exc.retry_after)
+                return "retry", int(exc.retry_after), str(exc)
+            except (TelegramForbiddenError, TelegramBadRequest) as exc:
+                return "failed", 0, str(exc)
+            except Exception as exc:
+                backoff = min(2 ** int(row["attempts"]) * 5, _MAX_BACKOFF_SECONDS)
+                return "retry", backoff, str(exc) or exc.__class__.__name__
+        return "sent", 0, ""
+
+
+notification_dispatcher = NotificationDispatcher()
@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+import operator
+import time
+from array import array
+from typing import Any, Iterable, Mapping
+
+from app.config import get_config
+from app.database.db import get_read_db
+from app.database.queries import iter_rank_rows
+
+logger = logging.getLogger(__name__)
+
+_BLOCK_SIZE = 1024
+_INT64_MIN = -(2**63)
+
+RankKey = tuple[int, int, int]
+_Block = tuple[array, array, array]
+
+
+def rank_key(row: Mapping[str, Any]) -> RankKey:
+    return (-int(row["balance"]), -int(row["total_referrals"]), int(row["id"]))
+
+
+def _new_block(keys: Iterable[RankKey] = ()) -> _Block:
+    block: _Block = (array("q"), array("q"), array("q"))
+    for key in keys:
+        _append(block, key)
+    return block
+
+
+def _append(block: _Block, key: RankKey) -> None:
+    for column, value in zip(block, key):
+        column.append(value)
+
+
+def _key_at(block: _Block, index: int) -> RankKey:
+    return (block[0][index], block[1][index], block[2][index])
+
+
+def _bisect(block: _Block, key: RankKey) -> int:
+    lo, hi = 0, len(block[0])
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _key_at(block, mid) < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _split(block: _Block, start: int, stop: int) -> _Block:
+    return (block[0][start:stop], block[1][start:stop], block[2][start:stop])
+
+
+class OrderStatisticIndex:
+    def __init__(self, block_size: int = _BLOCK_SIZE) -> None:
+        self._block_size = block_size
+        self._blocks: list[_Block] = []
+        self._maxes: list[RankKey] = []
+        self._tree: list[int] = [0]
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def load(self, keys: Iterable[RankKey]) -> None:
+        self._blocks = []
+        self._maxes = []
+        self._size = 0
+        self.extend(sorted(keys))
+
+    def extend(self, keys: Iterable[RankKey]) -> None:
+        ordered = list(keys)
+        if not ordered:
+            return
+        if (self._maxes and ordered[0] <= self._maxes[-1]) or any(
+            map(operator.ge, ordered, ordered[1:])
+        ):
+            raise ValueError("Ключи должны идти по возрастанию.")
+        columns = list(zip(*ordered))
+        start = 0
+        while start < len(ordered):
+            if not self._blocks or len(self._blocks[-1][0]) >= self._block_size:
+                self._blocks.append(_new_block())
+                self._maxes.append(ordered[start])
+            block = self._blocks[-1]
+            stop = min(len(ordered), start + self._block_size - len(block[0]))
+            for column, values in zip(block, columns):
+                column.extend(values[start:stop])
+            self._maxes[-1] = ordered[stop - 1]
+            start = stop
+        self._size += len(ordered)
+        self._rebuild_tree()
+
+    def _rebuild_tree(self) -> None:
+        count = len(self._blocks)
+        tree = [0] * (count + 1)
+        for i, block in enumerate(self._blocks, start=1):
+            tree[i] += len(block[0])
+            parent = i + (i & -i)
+            if parent <= count:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, pos: int, delta: int) -> None:
+        i = pos + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, pos: int) -> int:
+        total = 0
+        i = pos
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, rank: int) -> tuple[int, int]:
+        pos = 0
+        remaining = rank
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= remaining:
+                pos = nxt
+                remaining -= self._tree[nxt]
+            step >>= 1
+        return pos, remaining
+
+    def add(self, key: RankKey) -> None:
+        self._size += 1
+        if not self._blocks:
+            self._blocks.append(_new_block([key]))
+            self._maxes.append(key)
+            self._rebuild_tree()
+            return
+        pos = bisect.bisect_left(self._maxes, key)
+        if pos == len(self._blocks):
+            pos -= 1
+        block = self._blocks[pos]
+        index = _bisect(block, key)
+        for column, value in zip(block, key):
+            column.insert(index, value)
+        self._maxes[pos] = _key_at(block, -1)
+        length = len(block[0])
+        if length > self._block_size * 2:
+            half = length // 2
+            self._blocks[pos : pos + 1] = [_split(block, 0, half), _split(block, half, length)]
+            self._maxes[pos : pos + 1] = [_key_at(block, half - 1), _key_at(block, -1)]
+            self._rebuild_tree()
+        else:
+            self._tree_add(pos, 1)
+
+    def remove(self, key: RankKey) -> bool:
+        pos = bisect.bisect_left(self._maxes, key)
+        if pos == len(self._blocks):
+            return False
+        block = self._blocks[pos]
+        index = _bisect(block, key)
+        if index == len(block[0]) or _key_at(block, index) != key:
+            return False
+        for column in block:
+            del column[index]
+        self._size -= 1
+        if block[0]:
+            self._maxes[pos] = _key_at(block, -1)
+            self._tree_add(pos, -1)
+        else:
+            del self._blocks[pos]
+            del self._maxes[pos]
+            self._rebuild_tree()
+        return True
+
+    def index(self, key: RankKey) -> int:
+        pos = bisect.bisect_left(self._maxes, key)
+        if pos == len(self._blocks):
+            return self._size
+        return self._prefix(pos) + _bisect(self._blocks[pos], key)
+
+    def slice(self, start: int, stop: int) -> list[RankKey]:
+        start = max(start, 0)
+        stop = min(stop, self._size)
+        result: list[RankKey] = []
+        if start >= stop:
+            return result
+        pos, offset = self._locate(start)
+        while len(result) < stop - start and pos < len(self._blocks):
+            block = self._blocks[pos]
+            end = min(len(block[0]), offset + stop - start - len(result))
+            result.extend(_key_at(block, index) for index in range(offset, end))
+            offset = 0
+            pos += 1
+        return result
+
+
+class RankIndex:
+    def __init__(self, rebuild_interval: float | None = None) -> None:
+        self._rebuild_interval = rebuild_interval
+        self._ranks = OrderStatisticIndex()
+        self._scores = OrderStatisticIndex()
+        self._loaded_at: float | None = None
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task[None] | None = None
+        self._backlog: list[RankKey] | None = None
+        self.refreshes = 0
+
+    def __len__(self) -> int:
+        return len(self._ranks)
+
+    @property
+    def rebuild_interval(self) -> float:
+        if self._rebuild_interval is None:
+            self._rebuild_interval = get_config().rank_index_rebuild_interval
+        return self._rebuild_interval
+
+    def load(self, rows: Iterable[Mapping[str, Any]]) -> None:
+        keys = [rank_key(row) for row in rows]
+        ranks = OrderStatisticIndex()
+        ranks.load(keys)
+        scores = OrderStatisticIndex()
+        scores.load(_score_key(key) for key in keys)
+        self._swap(ranks, scores)
+
+    def _swap(self, ranks: OrderStatisticIndex, scores: OrderStatisticIndex) -> None:
+        self._ranks = ranks
+        self._scores = scores
+        self._loaded_at = time.monotonic()
+        self.refreshes += 1
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            self._backlog = []
+            try:
+                self._swap(*await _read_snapshot())
+                for key in self._backlog:
+                    self._apply(key)
+            finally:
+                self._backlog = None
+
+    async def start(self) -> None:
+        if self._loaded_at is None:
+            await self.refresh()
+        if self.rebuild_interval <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.rebuild_interval)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Не удалось перестроить индекс мест")
+
+    async def _ensure_loaded(self) -> None:
+        if self._loaded_at is not None:
+            return
+        async with self._lock:
+            loaded = self._loaded_at is not None
+        if not loaded:
+            await self.refresh()
+
+    def observe(self, row: Mapping[str, Any]) -> None:
+        key = rank_key(row)
+        if self._backlog is not None:
+            self._backlog.append(key)
+        if self._loaded_at is not None:
+            self._apply(key)
+
+    def _key(self, user_id: int) -> RankKey | None:
+        index = self._scores.index((user_id, _INT64_MIN, _INT64_MIN))
+        found = self._scores.slice(index, index + 1)
+        if not found or found[0][0] != user_id:
+            return None
+        _, balance, total_referrals = found[0]
+        return (-balance, -total_referrals, user_id)
+
+    def _apply(self, key: RankKey) -> None:
+        previous = self._key(key[2])
+        if previous == key:
+            return
+        if previous is not None:
+            self._ranks.remove(previous)
+            self._scores.remove(_score_key(previous))
+        self._ranks.add(key)
+        self._scores.add(_score_key(key))
+
+    def observe_many(self, rows: Iterable[Mapping[str, Any]]) -> None:
+        for row in rows:
+            self.observe(row)
+
+    async def position(self, user_id: int, around: int = 2) -> tuple[int, int, list[int]] | None:
+        await self._ensure_loaded()
+        key = self._key(user_id)
+        if key is None:
+            return None
+        index = self._ranks.index(key)
+        neighbours = self._ranks.slice(index - around, index + around + 1)
+        return index + 1, len(self._ranks), [neighbour[2] for neighbour in neighbours]
+
+
+def _score_key(key: RankKey) -> RankKey:
+    return (key[2], -key[0], -key[1])
+
+
+async def _read_snapshot() -> tuple[OrderStatisticIndex, OrderStatisticIndex]:
+    ranks = OrderStatisticIndex()
+    scores = OrderStatisticIndex()
+    async with get_read_db() as db:
+        await db.execute("BEGIN")
+        try:
+            async for rows in iter_rank_rows(db):
+                ranks.extend([(-row[1], -row[2], row[0]) for row in rows])
+            async for rows in iter_rank_rows(db, by_id=True):
+                scores.extend([(row[0], row[1], row[2]) for row in rows])
+        finally:
+            await db.rollback()
+    return ranks, scores
+
+
+rank_index = RankIndex()
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import json
+import math
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import unquote
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import Config, RateLimit, get_config
+from app.services.metrics import registry
+
+_USER_ID = re.compile(r'"id"\s*:\s*(\d+)')
+_INIT_DATA_HEADER = b"x-tg-init-data"
+_REJECTED_BODY = json.dumps({"detail": "Слишком много запросов, попробуйте позже."}).encode()
+
+rate_limited = registry.counter(
+    "pappy_rate_limited_total", "Запросы, отклонённые ограничением частоты.", ("route", "key")
+)
+
+
+class TokenBuckets:
+    def __init__(self, limit: RateLimit, max_keys: int, shards: int = 16) -> None:
+        self.rate = limit.rate
+        self.burst = float(limit.burst)
+        self._shard_size = max(max_keys // shards, 1)
+        self._shards: list[OrderedDict[object, tuple[float, float]]] = [
+            OrderedDict() for _ in range(shards)
+        ]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    def take(self, key: object, now: float) -> float:
+        shard = self._shards[hash(key) % len(self._shards)]
+        state = shard.get(key)
+        if state is None:
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            shard.move_to_end(key)
+        if tokens >= 1:
+            shard[key] = (tokens - 1, now)
+            while len(shard) > self._shard_size:
+                shard.popitem(last=False)
+            return 0.0
+        shard[key] = (tokens, now)
+        return (1 - tokens) / self.rate
+
+
+def user_key_from_init_data(init_data: str) -> tuple[int, str] | None:
+    params: dict[str, str] = {}
+    for part in init_data.split("&"):
+        name, _, value = part.partition("=")
+        if name in ("user", "hash"):
+            params[name] = value
+    received_hash = params.get("hash")
+    raw_user = params.get("user")
+    if not received_hash or not raw_user:
+        return None
+    match = _USER_ID.search(unquote(raw_user))
+    return (int(match.group(1)), received_hash) if match else None
+
+
+def _header(scope: Scope, name: bytes) -> str | None:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class RateLimitMiddleware:
+    def __init__(self, app: ASGIApp, config: Config | None = None) -> None:
+        config = config or get_config()
+        self.app = app
+        self.enabled = config.rate_limit_enabled
+        self._user_buckets = {
+            path: TokenBuckets(limit, config.rate_limit_max_keys)
+            for path, limit in config.rate_limits.items()
+        }
+        self._ip_buckets = TokenBuckets(config.rate_limit_ip, config.rate_limit_max_keys)
+        ip_header = config.rate_limit_ip_header
+        self._ip_header = ip_header.encode() if ip_header else None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        user_buckets = self._user_buckets.get(path)
+        if user_buckets is None:
+            await self.app(scope, receive, send)
+            return
+
+        now = time.monotonic()
+        retry_after = self._ip_buckets.take(self._client_ip(scope), now)
+        if retry_after:
+            rate_limited.labels(path, "ip").inc()
+            await self._reject(send, retry_after)
+            return
+
+        init_data = _header(scope, _INIT_DATA_HEADER)
+        user_key = user_key_from_init_data(init_data) if init_data else None
+        if user_key is not None:
+            retry_after = user_buckets.take(user_key, now)
+            if retry_after:
+                rate_limited.labels(path, "user").inc()
+                await self._reject(send, retry_after)
+                return
+
+        await self.app(scope, receive, send)
+
+    def _client_ip(self, scope: Scope) -> str:
+        if self._ip_header is not None:
+            forwarded = _header(scope, self._ip_header)
+            if forwarded:
+                return forwarded.rsplit(",", 1)[-1].strip()
+        client = scope.get("client")
+        return client[0] if client else ""
+
+    async def _reject(self, send: Send, retry_after: float) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(_REJECTED_BODY)).encode()),
+                    (b"retry-after", str(max(math.ceil(retry_after), 1)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": _REJECTED_BODY})
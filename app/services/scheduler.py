@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.middlewares.error import ErrorsMiddleware
+from aiogram.types import Chat, TelegramObject, User
+
+from app.config import get_config
+from app.services.metrics import HistogramFamily, handler_seconds
+
+logger = logging.getLogger(__name__)
+
+
+Handler = Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]]
+
+
+def _ordering_key(data: dict[str, Any]) -> int | None:
+    user: User | None = data.get("event_from_user")
+    if user is not None:
+        return user.id
+    chat: Chat | None = data.get("event_chat")
+    if chat is not None:
+        return chat.id
+    return None
+
+
+class OrderedUpdateScheduler(BaseMiddleware):
+    def __init__(self, workers: int | None = None, max_pending: int | None = None) -> None:
+        self._workers_count = workers
+        self._max_pending = max_pending
+        self._pending_slots: asyncio.Semaphore | None = None
+        self._queues: dict[int, deque[tuple[Handler, TelegramObject, dict[str, Any]]]] = {}
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers: list[asyncio.Task[None]] = []
+        self.pending = 0
+        self.max_seen_pending = 0
+        self.processed = 0
+        self.throttled = 0
+
+    @property
+    def workers_count(self) -> int:
+        if self._workers_count is None:
+            self._workers_count = get_config().update_concurrency
+        return self._workers_count
+
+    @property
+    def max_pending(self) -> int:
+        if self._max_pending is None:
+            self._max_pending = get_config().update_queue_size
+        return self._max_pending
+
+    @property
+    def _slots(self) -> asyncio.Semaphore:
+        if self._pending_slots is None:
+            self._pending_slots = asyncio.Semaphore(self.max_pending)
+        return self._pending_slots
+
+    def start(self, dispatcher: Dispatcher) -> None:
+        if self._workers:
+            return
+        errors = ErrorsMiddleware(dispatcher)
+        self._workers = [
+            asyncio.create_task(self._work(errors)) for _ in range(self.workers_count)
+        ]
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались обработки %d обновлений", self.pending)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def __call__(
+        self, handler: Handler, event: TelegramObject, data: dict[str, Any]
+    ) -> Any:
+        key = _ordering_key(data)
+        if key is None or not self._workers:
+            return await handler(event, data)
+
+        if self._slots.locked():
+            self.throttled += 1
+        await self._slots.acquire()
+        self.pending += 1
+        self.max_seen_pending = max(self.max_seen_pending, self.pending)
+        self._idle.clear()
+        queue = self._queues.get(key)
+        if queue is None:
+            self._queues[key] = deque([(handler, event, data)])
+            self._ready.put_nowait(key)
+        else:
+            queue.append((handler, event, data))
+        return None
+
+    async def _work(self, errors: ErrorsMiddleware) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._queues[key]
+            handler, event, data = queue[0]
+            try:
+                await errors(handler, event, data)
+            except Exception:
+                logger.exception("Ошибка при обработке обновления")
+            finally:
+                queue.popleft()
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._queues[key]
+                self.processed += 1
+                self.pending -= 1
+                if not self.pending:
+                    self._idle.set()
+                self._slots.release()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "workers": len(self._workers),
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "max_seen_pending": self.max_seen_pending,
+            "active_keys": len(self._queues),
+            "processed": self.processed,
+            "throttled": self.throttled,
+        }
+
+
+class HandlerLatencyMiddleware(BaseMiddleware):
+    def __init__(self, family: HistogramFamily) -> None:
+        self.family = family
+
+    async def __call__(
+        self, handler: Handler, event: TelegramObject, data: dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        name = getattr(callback, "__name__", None) or "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.family.labels(name).observe(time.perf_counter() - started)
+
+
+update_scheduler = OrderedUpdateScheduler()
+handler_latency = HandlerLatencyMiddleware(handler_seconds)
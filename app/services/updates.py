@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import logging
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateFeeder:
+    def __init__(self) -> None:
+        self._dp: Dispatcher | None = None
+        self._bot: Bot | None = None
+        self.received = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._dp is not None
+
+    def start(self, dp: Dispatcher, bot: Bot) -> None:
+        self._dp = dp
+        self._bot = bot
+
+    async def stop(self) -> None:
+        self._dp = None
+
+    async def feed(self, data: dict[str, Any]) -> None:
+        if self._dp is None or self._bot is None:
+            raise RuntimeError("Приём обновлений не запущен.")
+        update = Update.model_validate(data, context={"bot": self._bot})
+        self.received += 1
+        try:
+            await self._dp.feed_update(self._bot, update)
+        except Exception:
+            self.failed += 1
+            logger.exception("Ошибка при обработке обновления %s", update.update_id)
+
+
+update_feeder = UpdateFeeder()
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import time
+from typing import Any
+
+import aiohttp
+
+from app.config import get_config
+
+_update_ids = itertools.count(int(time.time()))
+
+
+def build_message_update(
+    text: str, user_id: int, chat_id: int, username: str | None = None
+) -> dict[str, Any]:
+    update_id = next(_update_ids)
+    chat_type = "private" if chat_id == user_id else "supergroup"
+    chat: dict[str, Any] = {"id": chat_id, "type": chat_type}
+    if chat_type == "supergroup":
+        chat["title"] = "Pappy"
+    sender: dict[str, Any] = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+    if username:
+        sender["username"] = username
+    message: dict[str, Any] = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": chat,
+        "from": sender,
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+
+async def post_updates(
+    url: str,
+    secret: str,
+    updates: list[dict[str, Any]],
+    concurrency: int,
+) -> list[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+
+        async def post(update: dict[str, Any]) -> float:
+            async with semaphore:
+                started = time.perf_counter()
+                async with session.post(url, json=update) as response:
+                    if response.status != 200:
+                        body = await response.text()
+                        raise RuntimeError(f"{response.status}: {body}")
+                return time.perf_counter() - started
+
+        return await asyncio.gather(*(post(update) for update in updates))
+
+
+def main() -> None:
+    config = get_config()
+    parser = argparse.ArgumentParser(description="Отправляет тестовые обновления на вебхук бота.")
+    parser.add_argument(
+        "--url",
+        default=f"http://127.0.0.1:{config.webapp_port}/telegram/webhook",
+    )
+    parser.add_argument("--secret", default=config.webhook_secret or "")
+    parser.add_argument("--text", default="Тестовое сообщение из группы")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--username", default=None)
+    parser.add_argument("--chat-id", type=int, default=config.group_id or 1)
+    parser.add_argument("--users", type=int, default=1, help="сколько разных отправителей")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    updates = [
+        build_message_update(
+            args.text,
+            user_id=args.user_id + index % args.users,
+            chat_id=args.chat_id,
+            username=args.username,
+        )
+        for index in range(args.count)
+    ]
+    started = time.perf_counter()
+    latencies = sorted(asyncio.run(post_updates(args.url, args.secret, updates, args.concurrency)))
+    elapsed = time.perf_counter() - started
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+    print(
+        f"Отправлено {len(updates)} обновлений за {elapsed:.2f} с, "
+        f"p50 {p50 * 1000:.1f} мс, p99 {p99 * 1000:.1f} мс"
+    )
+
+
+if __name__ == "__main__":
+    main()
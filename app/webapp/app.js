@@ -4,6 +4,9 @@ const state = {
   balance: 0,
   selectedAmount: null,
   selectedTitle: "",
+  linkRetries: 0,
+  leaderboardNext: null,
+  leaderboardCount: 0,
 };
 
 const elements = {
@@ -14,6 +17,10 @@ const elements = {
   progressText: document.getElementById("progress-text"),
   progressFill: document.getElementById("progress-fill"),
   leaderboardList: document.getElementById("leaderboard-list"),
+  leaderboardMore: document.getElementById("leaderboard-more"),
+  rankSection: document.getElementById("rank-section"),
+  rankValue: document.getElementById("rank-value"),
+  rankList: document.getElementById("rank-list"),
   referralLink: document.getElementById("referral-link"),
   copyLink: document.getElementById("copy-link"),
   authWarning: document.getElementById("auth-warning"),
@@ -74,43 +81,91 @@ function animateBalance(target) {
   requestAnimationFrame(step);
 }
 
-async function loadProfile() {
+function renderProfile(data) {
+  animateBalance(data.balance);
+  elements.referrals.textContent = data.total_referrals;
+  elements.level.textContent = data.level.name;
+  elements.activity.textContent = data.total_referral_messages;
+  elements.progressText.textContent = `${data.level.progress_percent}%`;
+  elements.progressFill.style.width = `${data.level.progress_percent}%`;
+  const link = data.referral_link || (data.referral_link_status ? null : data.start_link);
+  if (link) {
+    elements.referralLink.textContent = link;
+    elements.copyLink.disabled = false;
+  } else {
+    elements.referralLink.textContent = "Ссылка появится позже.";
+    elements.copyLink.disabled = true;
+  }
+}
+
+function renderLeaderboardItem(item, position, current = false) {
+  const row = document.createElement("div");
+  row.className = current ? "leaderboard-item current" : "leaderboard-item";
+  row.innerHTML = `
+    <div class="leaderboard-name">
+      <strong>${position}. ${item.name}</strong>
+      <span>${item.level}</span>
+    </div>
+    <div class="leaderboard-score">${item.balance.toFixed(2)} Pappy</div>
+  `;
+  return row;
+}
+
+function appendLeaderboard(items, next) {
+  items.forEach((item) => {
+    state.leaderboardCount += 1;
+    elements.leaderboardList.appendChild(renderLeaderboardItem(item, state.leaderboardCount));
+  });
+  state.leaderboardNext = next || null;
+  elements.leaderboardMore.classList.toggle("hidden", !state.leaderboardNext);
+}
+
+function renderLeaderboard(data) {
+  elements.leaderboardList.innerHTML = "";
+  state.leaderboardCount = 0;
+  appendLeaderboard(data.items, data.next);
+}
+
+async function loadMoreLeaderboard() {
+  if (!state.leaderboardNext) {
+    return;
+  }
+  elements.leaderboardMore.disabled = true;
   try {
-    const data = await fetchJSON("/api/me");
-    animateBalance(data.balance);
-    elements.referrals.textContent = data.total_referrals;
-    elements.level.textContent = data.level.name;
-    elements.activity.textContent = data.total_referral_messages;
-    elements.progressText.textContent = `${data.level.progress_percent}%`;
-    elements.progressFill.style.width = `${data.level.progress_percent}%`;
-    if (data.referral_link) {
-      elements.referralLink.textContent = data.referral_link;
-      elements.copyLink.disabled = false;
-    } else {
-      elements.referralLink.textContent = "Ссылка появится позже.";
-      elements.copyLink.disabled = true;
-    }
+    const after = encodeURIComponent(state.leaderboardNext);
+    const data = await fetchJSON(`/api/leaderboard?after=${after}`);
+    appendLeaderboard(data.items, data.next);
   } catch (error) {
     showAlert(error.message);
+  } finally {
+    elements.leaderboardMore.disabled = false;
   }
 }
 
-async function loadLeaderboard() {
+function renderRank(data) {
+  if (!data) {
+    elements.rankSection.classList.add("hidden");
+    return;
+  }
+  elements.rankValue.textContent = `${data.rank} из ${data.total}`;
+  elements.rankList.innerHTML = "";
+  data.neighbours.forEach((item) => {
+    const current = item.rank === data.rank;
+    elements.rankList.appendChild(renderLeaderboardItem(item, item.rank, current));
+  });
+  elements.rankSection.classList.remove("hidden");
+}
+
+async function loadBootstrap() {
   try {
-    const data = await fetchJSON("/api/leaderboard");
-    elements.leaderboardList.innerHTML = "";
-    data.items.forEach((item, index) => {
-      const row = document.createElement("div");
-      row.className = "leaderboard-item";
-      row.innerHTML = `
-        <div class="leaderboard-name">
-          <strong>${index + 1}. ${item.name}</strong>
-          <span>${item.level}</span>
-        </div>
-        <div class="leaderboard-score">${item.balance.toFixed(2)} Pappy</div>
-      `;
-      elements.leaderboardList.appendChild(row);
-    });
+    const data = await fetchJSON("/api/bootstrap");
+    renderProfile(data.me);
+    renderLeaderboard(data.leaderboard);
+    renderRank(data.rank);
+    if (data.me.referral_link_status === "pending" && state.linkRetries < 5) {
+      state.linkRetries += 1;
+      setTimeout(loadBootstrap, 3000 * state.linkRetries);
+    }
   } catch (error) {
     showAlert(error.message);
   }
@@ -169,8 +224,7 @@ async function handleExchange() {
     });
     closeModal();
     showAlert("Обмен выполнен.");
-    await loadProfile();
-    await loadLeaderboard();
+    await loadBootstrap();
   } catch (error) {
     elements.modalError.textContent = error.message;
   }
@@ -214,6 +268,7 @@ elements.modal.addEventListener("click", (event) => {
   }
 });
 elements.copyLink.addEventListener("click", copyReferral);
+elements.leaderboardMore.addEventListener("click", loadMoreLeaderboard);
 
 setupTabs();
 setupRewards();
@@ -221,8 +276,7 @@ setupRewards();
 if (!tg || !tg.initData) {
   elements.authWarning.classList.remove("hidden");
 } else {
-  loadProfile();
-  loadLeaderboard();
+  loadBootstrap();
 }
 
 if (tg) {
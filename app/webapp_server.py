@@ -3,35 +3,56 @@ from __future__ import annotations
 import hashlib
 import hmac
 import json
+import logging
 import os
-from typing import Any
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, AsyncIterator
 from urllib.parse import parse_qsl
 
+import aiosqlite
 from aiogram import Bot
-from aiogram.enums import ParseMode
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import RedirectResponse
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from app.config import load_config
-from app.database.db import get_db
+from app.bot import get_bot
+from app.config import Config, get_config, require_bot_token
+from app.database.db import Connection, close_pool, get_db, get_read_db, open_pool, uow
 from app.database.schema import init_db
 from app.database.queries import (
+    claim_pooled_invite_link,
     ensure_user,
+    get_current_user,
     get_invite_link_for_user,
-    get_top_users,
     get_user,
-    save_invite_link,
+    get_users_by_ids,
     try_exchange,
 )
+from app.handlers import build_dispatcher
+from app.services.cooldown import cooldown_tracker
+from app.services.identity import bot_identity
+from app.services.ingest import message_ingest
+from app.services.invites import invite_provisioner
+from app.services.leaderboard import display_name, leaderboard, parse_cursor
 from app.services.levels import get_level
+from app.services.metrics import CONTENT_TYPE, http_request_seconds, registry, start_exporter
+from app.services.money import from_units, to_units
+from app.services.notifier import notification_dispatcher
+from app.services.ranking import rank_index
+from app.services.ratelimit import RateLimitMiddleware
+from app.services.scheduler import update_scheduler
+from app.services.updates import update_feeder
+
+logger = logging.getLogger(__name__)
 
-config = load_config()
-bot = Bot(token=config.bot_token, parse_mode=ParseMode.HTML)
-bot_username: str | None = None
 
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "webapp")
+WEBHOOK_PATH = "/telegram/webhook"
 
 
 class ExchangeRequest(BaseModel):
@@ -39,6 +60,63 @@ class ExchangeRequest(BaseModel):
     steam_link: str
 
 
+class _InitDataCache:
+    def __init__(self, max_size: int | None = None) -> None:
+        self._max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[str, tuple[str, dict[str, Any], float]] = OrderedDict()
+
+    @property
+    def max_size(self) -> int:
+        if self._max_size is None:
+            self._max_size = get_config().init_data_cache_size
+        return self._max_size
+
+    def get(self, received_hash: str, init_data: str, now: float) -> dict[str, Any] | None:
+        item = self._items.get(received_hash)
+        if item is None:
+            self.misses += 1
+            return None
+        cached_init_data, user, expires_at = item
+        if expires_at <= now:
+            del self._items[received_hash]
+            self.misses += 1
+            return None
+        if not hmac.compare_digest(cached_init_data, init_data):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(received_hash)
+        return user
+
+    def put(
+        self, received_hash: str, init_data: str, user: dict[str, Any], expires_at: float
+    ) -> None:
+        if self.max_size <= 0:
+            return
+        self._items[received_hash] = (init_data, user, expires_at)
+        self._items.move_to_end(received_hash)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+_init_data_cache = _InitDataCache()
+
+
+@lru_cache(maxsize=None)
+def _init_data_secret() -> bytes:
+    bot_token = require_bot_token(get_config())
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
+def _find_hash(init_data: str) -> str:
+    for part in init_data.split("&"):
+        if part.startswith("hash="):
+            return part[5:]
+    return ""
+
+
 def _validate_init_data(init_data: str) -> dict[str, Any]:
     if not init_data:
         raise HTTPException(status_code=401, detail="Нет данных авторизации.")
@@ -49,9 +127,8 @@ def _validate_init_data(init_data: str) -> dict[str, Any]:
         raise HTTPException(status_code=401, detail="Нет подписи авторизации.")
 
     data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
-    secret_key = hmac.new(b"WebAppData", config.bot_token.encode(), hashlib.sha256).digest()
     calculated_hash = hmac.new(
-        secret_key, data_check_string.encode(), hashlib.sha256
+        _init_data_secret(), data_check_string.encode(), hashlib.sha256
     ).hexdigest()
 
     if not hmac.compare_digest(calculated_hash, received_hash):
@@ -73,13 +150,63 @@ def _extract_user(data: dict[str, Any]) -> dict[str, Any]:
     return user
 
 
+def _auth_expires_at(data: dict[str, Any], now: float) -> float:
+    try:
+        auth_date = int(data.get("auth_date", ""))
+    except ValueError as exc:
+        raise HTTPException(status_code=401, detail="Нет даты авторизации.") from exc
+    expires_at = auth_date + get_config().init_data_ttl
+    if expires_at <= now:
+        raise HTTPException(status_code=401, detail="Данные авторизации устарели.")
+    return expires_at
+
+
 async def _get_user_from_request(request: Request) -> dict[str, Any]:
     init_data = request.headers.get("X-Tg-Init-Data", "")
+    now = time.time()
+    received_hash = _find_hash(init_data)
+    if received_hash:
+        user = _init_data_cache.get(received_hash, init_data, now)
+        if user is not None:
+            return user
+
     data = _validate_init_data(init_data)
-    return _extract_user(data)
+    expires_at = _auth_expires_at(data, now)
+    user = _extract_user(data)
+    _init_data_cache.put(received_hash, init_data, user, expires_at)
+    return user
+
+
+class _RequestMetrics:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            http_request_seconds.labels(
+                scope["method"], getattr(route, "path", "unmatched"), status
+            ).observe(time.perf_counter() - started)
 
 
 app = FastAPI(title="Pappy мини-приложение")
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(_RequestMetrics)
 
 
 @app.get("/")
@@ -87,72 +214,188 @@ async def root() -> RedirectResponse:
     return RedirectResponse(url="/app")
 
 
-@app.get("/api/me")
-async def api_me(request: Request) -> dict[str, Any]:
-    tg_user = await _get_user_from_request(request)
-    user_id = int(tg_user["id"])
-    username = tg_user.get("username")
+async def _read_profile(
+    db: Connection, config: Config, user_id: int, username: str | None
+) -> tuple[aiosqlite.Row, str | None] | None:
+    row = await get_current_user(db, user_id, username)
+    if row is None:
+        return None
+    referral_link = None
+    if config.group_id is not None:
+        referral_link = await get_invite_link_for_user(db, user_id)
+        if referral_link is None and not invite_provisioner.is_pending(user_id):
+            return None
+    return row, referral_link
 
-    async with get_db() as db:
-        await ensure_user(db, user_id, username)
-        row = await get_user(db, user_id)
+
+async def _write_profile(
+    db: Connection, config: Config, user_id: int, username: str | None
+) -> tuple[aiosqlite.Row, str | None]:
+    async with uow(db):
+        row = await ensure_user(db, user_id, username)
 
         referral_link = None
         if config.group_id is not None:
             referral_link = await get_invite_link_for_user(db, user_id)
-            if referral_link is None:
-                try:
-                    invite = await bot.create_chat_invite_link(
-                        chat_id=config.group_id,
-                        name=f"ref-{user_id}",
-                    )
-                    referral_link = invite.invite_link
-                    await save_invite_link(db, user_id, referral_link)
-                except Exception:
-                    referral_link = None
-
-    if not row:
-        raise HTTPException(status_code=404, detail="Пользователь не найден.")
+            if referral_link is None and not invite_provisioner.is_pending(user_id):
+                referral_link = await claim_pooled_invite_link(db, user_id)
+    return row, referral_link
+
+
+@asynccontextmanager
+async def _open_profile(
+    config: Config, user_id: int, username: str | None
+) -> AsyncIterator[tuple[Connection, aiosqlite.Row, str | None]]:
+    async with get_read_db() as db:
+        profile = await _read_profile(db, config, user_id, username)
+        if profile is not None:
+            yield db, *profile
+            return
+
+    async with get_db() as db:
+        row, referral_link = await _write_profile(db, config, user_id, username)
+        yield db, row, referral_link
+
+
+async def _load_profile(
+    config: Config, user_id: int, username: str | None
+) -> tuple[aiosqlite.Row, str | None]:
+    async with _open_profile(config, user_id, username) as (_, row, referral_link):
+        return row, referral_link
 
+
+def _request_referral_link(config: Config, user_id: int, referral_link: str | None) -> None:
+    if config.group_id is not None and referral_link is None:
+        invite_provisioner.request(user_id)
+
+
+def _referral_link_status(config: Config, referral_link: str | None) -> str | None:
+    if config.group_id is None:
+        return None
+    return "ready" if referral_link is not None else "pending"
+
+
+def _profile_payload(
+    config: Config,
+    user_id: int,
+    username: str | None,
+    row: aiosqlite.Row,
+    referral_link: str | None,
+) -> dict[str, Any]:
     total_referrals = int(row["total_referrals"])
     level = get_level(total_referrals)
 
     return {
         "id": user_id,
         "username": username,
-        "balance": float(row["balance"]),
+        "balance": from_units(int(row["balance"])),
         "total_referrals": total_referrals,
         "total_referral_messages": int(row["total_referral_messages"]),
         "level": level,
         "referral_link": referral_link,
+        "referral_link_status": _referral_link_status(config, referral_link),
+        "start_link": bot_identity.start_link(user_id),
     }
 
 
-@app.get("/api/leaderboard")
-async def api_leaderboard(request: Request) -> dict[str, Any]:
-    await _get_user_from_request(request)
-    async with get_db() as db:
-        rows = await get_top_users(db, limit=20)
-
-    items = []
-    for row in rows:
-        username = row["username"]
-        display = f"@{username}" if username else f"Пользователь {row['id']}"
-        level = get_level(int(row["total_referrals"]))
-        items.append(
+async def _rank_payload(
+    db: Connection, user_id: int, row: aiosqlite.Row
+) -> dict[str, Any] | None:
+    rank_index.observe(row)
+    position = await rank_index.position(user_id)
+    if position is None:
+        return None
+    rank, total, neighbour_ids = position
+
+    rows = {int(item["id"]): item for item in await get_users_by_ids(db, neighbour_ids)}
+
+    first_rank = rank - neighbour_ids.index(user_id)
+    neighbours = []
+    for offset, neighbour_id in enumerate(neighbour_ids):
+        neighbour = rows.get(neighbour_id)
+        if neighbour is None:
+            continue
+        neighbours.append(
             {
-                "id": int(row["id"]),
-                "name": display,
-                "balance": float(row["balance"]),
-                "level": level["name"],
+                "rank": first_rank + offset,
+                "id": neighbour_id,
+                "name": display_name(neighbour_id, neighbour["username"]),
+                "balance": from_units(int(neighbour["balance"])),
+                "level": get_level(int(neighbour["total_referrals"]))["name"],
             }
         )
 
-    return {"items": items}
+    return {"rank": rank, "total": total, "neighbours": neighbours}
+
+
+@app.get("/api/me")
+async def api_me(request: Request, config: Config = Depends(get_config)) -> dict[str, Any]:
+    tg_user = await _get_user_from_request(request)
+    user_id = int(tg_user["id"])
+    username = tg_user.get("username")
+
+    row, referral_link = await _load_profile(config, user_id, username)
+    _request_referral_link(config, user_id, referral_link)
+
+    return _profile_payload(config, user_id, username, row, referral_link)
+
+
+@app.get("/api/leaderboard", response_model=None)
+async def api_leaderboard(
+    request: Request, after: str | None = None
+) -> Response | dict[str, Any]:
+    await _get_user_from_request(request)
+    if after is not None:
+        cursor = parse_cursor(after)
+        if cursor is None:
+            raise HTTPException(status_code=400, detail="Некорректный курсор таблицы лидеров.")
+        return await leaderboard.page_after(cursor)
+
+    payload, etag = await leaderboard.payload()
+    headers = {"ETag": etag, "Cache-Control": leaderboard.cache_control}
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=payload, media_type="application/json", headers=headers)
+
+
+@app.get("/api/rank")
+async def api_rank(request: Request) -> dict[str, Any]:
+    tg_user = await _get_user_from_request(request)
+    user_id = int(tg_user["id"])
+
+    async with get_read_db() as db:
+        row = await get_user(db, user_id)
+        if not row:
+            raise HTTPException(status_code=404, detail="Пользователь не найден.")
+        rank = await _rank_payload(db, user_id, row)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден.")
+    return rank
+
+
+@app.get("/api/bootstrap")
+async def api_bootstrap(
+    request: Request, config: Config = Depends(get_config)
+) -> dict[str, Any]:
+    tg_user = await _get_user_from_request(request)
+    user_id = int(tg_user["id"])
+    username = tg_user.get("username")
+
+    async with _open_profile(config, user_id, username) as (db, row, referral_link):
+        rank = await _rank_payload(db, user_id, row)
+    _request_referral_link(config, user_id, referral_link)
+
+    return {
+        "me": _profile_payload(config, user_id, username, row, referral_link),
+        "leaderboard": await leaderboard.first_page(),
+        "rank": rank,
+    }
 
 
 @app.post("/api/exchange")
-async def api_exchange(request: Request, payload: ExchangeRequest) -> dict[str, Any]:
+async def api_exchange(
+    request: Request, payload: ExchangeRequest, config: Config = Depends(get_config)
+) -> dict[str, Any]:
     tg_user = await _get_user_from_request(request)
     user_id = int(tg_user["id"])
     username = tg_user.get("username")
@@ -164,40 +407,107 @@ async def api_exchange(request: Request, payload: ExchangeRequest) -> dict[str,
     if not steam_link:
         raise HTTPException(status_code=400, detail="Введите SteamLink.")
 
-    async with get_db() as db:
+    display = f"@{username}" if username else "без ника"
+    text = (
+        f"Пользователь {display} (айди: {user_id}) обменял {amount:.2f} Pappy.\n"
+        f"SteamLink: {steam_link}"
+    )
+    notifications = [(admin_id, text) for admin_id in config.admin_ids]
+
+    async with get_db() as db, uow(db):
         await ensure_user(db, user_id, username)
-        success = await try_exchange(db, user_id, amount, steam_link)
+        updated = await try_exchange(db, user_id, to_units(amount), steam_link, notifications)
 
-    if not success:
+    if updated is None:
         raise HTTPException(status_code=400, detail="Недостаточно Pappy для обмена.")
-
-    if config.admin_ids:
-        display = f"@{username}" if username else "без ника"
-        text = (
-            f"Пользователь {display} (айди: {user_id}) обменял {amount:.2f} Pappy.\n"
-            f"SteamLink: {steam_link}"
-        )
-        for admin_id in config.admin_ids:
-            await bot.send_message(admin_id, text)
+    leaderboard.observe(updated)
+    rank_index.observe(updated)
+    if notifications:
+        notification_dispatcher.wake()
 
     return {"ok": True}
 
 
+@app.get("/metrics")
+async def metrics(request: Request, config: Config = Depends(get_config)) -> Response:
+    if config.metrics_token is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization, f"Bearer {config.metrics_token}"):
+        raise HTTPException(status_code=401, detail="Некорректный токен метрик.")
+    return Response(content=registry.render(), headers={"Content-Type": CONTENT_TYPE})
+
+
+@app.post(WEBHOOK_PATH)
+async def telegram_webhook(
+    request: Request, config: Config = Depends(get_config)
+) -> Response:
+    if not update_feeder.running or config.webhook_secret is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token, config.webhook_secret):
+        raise HTTPException(status_code=401, detail="Некорректный секрет вебхука.")
+    try:
+        await update_feeder.feed(await request.json())
+    except (ValueError, ValidationError):
+        raise HTTPException(status_code=400, detail="Некорректное обновление.")
+    return Response(status_code=200)
+
+
+async def _start_webhook(config: Config, bot: Bot) -> None:
+    await cooldown_tracker.load()
+    message_ingest.start()
+    dp = build_dispatcher(config)
+    update_scheduler.start(dp)
+    update_feeder.start(dp, bot)
+    if config.webhook_url is None:
+        logger.warning("WEBHOOK_URL не задан, вебхук в Телеграме не регистрируется")
+        return
+    try:
+        await bot.set_webhook(
+            f"{config.webhook_url}{WEBHOOK_PATH}",
+            secret_token=config.webhook_secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=config.update_concurrency,
+        )
+    except Exception:
+        logger.exception("Не удалось зарегистрировать вебхук")
+
+
 @app.on_event("shutdown")
 async def shutdown_event() -> None:
-    await bot.session.close()
+    if update_feeder.running:
+        await update_feeder.stop()
+        await update_scheduler.stop()
+        await message_ingest.stop()
+    await invite_provisioner.stop()
+    await notification_dispatcher.stop()
+    await bot_identity.stop()
+    await rank_index.stop()
+    await get_bot().session.close()
+    await close_pool()
+    exporter = getattr(app.state, "metrics_exporter", None)
+    if exporter is not None:
+        await exporter.cleanup()
 
 
 @app.on_event("startup")
 async def startup_event() -> None:
-    global bot_username
+    config = get_config()
+    bot = get_bot()
+    await open_pool()
     async with get_db() as db:
         await init_db(db)
-    try:
-        me = await bot.get_me()
-        bot_username = me.username
-    except Exception:
-        bot_username = None
+    await bot_identity.start(bot)
+    await rank_index.start()
+    invite_provisioner.start(bot, config.group_id)
+    notification_dispatcher.start(bot)
+    if config.bot_mode == "webhook":
+        if config.metrics_port:
+            app.state.metrics_exporter = await start_exporter(
+                config.metrics_host, config.metrics_port
+            )
+        await _start_webhook(config, bot)
 
 
 app.mount("/app", StaticFiles(directory=STATIC_DIR, html=True), name="webapp")
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+import sqlite3
+import time
+from typing import Any
+from urllib.parse import urlencode
+
+from benchmarks.common import Result, Timer, configure, report
+
+_EXCHANGE_AMOUNT = 10
+_BENCH_ADMIN_ID = 1
+
+
+def sign_init_data(bot_token: str, user: dict[str, Any]) -> str:
+    data = {
+        "auth_date": str(int(time.time())),
+        "query_id": f"bench{user['id']}",
+        "user": json.dumps(user, separators=(",", ":")),
+    }
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(data.items()))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    data["hash"] = hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(data)
+
+
+def _load_users(db_path: str, rich: int) -> tuple[int, list[int]]:
+    conn = sqlite3.connect(db_path)
+    try:
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+        rows = conn.execute(
+            "SELECT id FROM users ORDER BY balance DESC, total_referrals DESC, id LIMIT ?",
+            (rich,),
+        ).fetchall()
+    finally:
+        conn.close()
+    if not max_id:
+        raise SystemExit("База пуста, сначала запустите python -m benchmarks.seed.")
+    return int(max_id), [int(row[0]) for row in rows]
+
+
+def _fund(db_path: str, amounts: dict[int, int]) -> None:
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.executemany(
+                "UPDATE users SET balance = balance + ? WHERE id = ?",
+                [(amount, user_id) for user_id, amount in amounts.items()],
+            )
+    finally:
+        conn.close()
+
+
+async def _drive(
+    client: Any,
+    name: str,
+    requests: list[tuple[str, str, dict[str, Any]]],
+    concurrency: int,
+) -> Result:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+
+    async def send(method: str, url: str, kwargs: dict[str, Any]) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    timer = Timer()
+    await asyncio.gather(*(send(method, url, kwargs) for method, url, kwargs in requests))
+    return timer.result(name, latencies, statuses=dict(sorted(statuses.items())))
+
+
+async def run(args: argparse.Namespace) -> list[Result]:
+    import httpx
+
+    from app.config import get_config
+    from app.database.db import close_pool, get_db, open_pool
+    from app.database.schema import init_db
+    from app.services.money import to_units
+    from app.webapp_server import app
+
+    bot_token = get_config().bot_token
+    max_id, rich_ids = _load_users(args.db, args.rich_users)
+    rng = random.Random(args.seed)
+    init_data: dict[int, str] = {}
+
+    def headers(user_id: int) -> dict[str, str]:
+        signed = init_data.get(user_id)
+        if signed is None:
+            user = {"id": user_id, "first_name": f"User {user_id}", "username": f"user{user_id}"}
+            signed = init_data[user_id] = sign_init_data(bot_token, user)
+        return {"X-Tg-Init-Data": signed}
+
+    population = [rng.randint(1, max_id) for _ in range(args.users)]
+    me_requests = [
+        ("GET", "/api/me", {"headers": headers(rng.choice(population))})
+        for _ in range(args.requests)
+    ]
+    exchangers = [rng.choice(rich_ids) for _ in range(args.exchanges)]
+    exchange_requests = [
+        (
+            "POST",
+            "/api/exchange",
+            {
+                "headers": headers(user_id),
+                "json": {
+                    "amount": _EXCHANGE_AMOUNT,
+                    "steam_link": "https://steamcommunity.com/tradeoffer/new/",
+                },
+            },
+        )
+        for user_id in exchangers
+    ]
+    funding: dict[int, int] = {}
+    for user_id in exchangers:
+        funding[user_id] = funding.get(user_id, 0) + to_units(_EXCHANGE_AMOUNT)
+    _fund(args.db, funding)
+
+    await open_pool()
+    try:
+        async with get_db() as db:
+            await init_db(db)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            results = [await _drive(client, "/api/me", me_requests, args.concurrency)]
+
+            first = await client.get("/api/leaderboard", headers=headers(population[0]))
+            cursor = first.json().get("next")
+            pages = []
+            for _ in range(args.leaderboard_pages):
+                if cursor is None:
+                    break
+                response = await client.get(
+                    "/api/leaderboard",
+                    params={"after": cursor},
+                    headers=headers(population[0]),
+                )
+                pages.append(cursor)
+                cursor = response.json().get("next")
+            leaderboard_requests = [
+                ("GET", "/api/leaderboard", {"headers": headers(rng.choice(population))})
+                for _ in range(args.requests)
+            ] + [
+                (
+                    "GET",
+                    "/api/leaderboard",
+                    {
+                        "params": {"after": rng.choice(pages)},
+                        "headers": headers(rng.choice(population)),
+                    },
+                )
+                for _ in range(args.requests if pages else 0)
+            ]
+            rng.shuffle(leaderboard_requests)
+            results.append(
+                await _drive(client, "/api/leaderboard", leaderboard_requests, args.concurrency)
+            )
+            results.append(
+                await _drive(client, "/api/exchange", exchange_requests, args.concurrency)
+            )
+        return results
+    finally:
+        await close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагружает API мини-приложения без сети.")
+    parser.add_argument("--db", default="./bench.sqlite3")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--exchanges", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=10000, help="сколько разных пользователей")
+    parser.add_argument("--rich-users", type=int, default=1000, help="кто участвует в обменах")
+    parser.add_argument("--leaderboard-pages", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--single-writer", action="store_true", help="включить DB_SINGLE_WRITER")
+    parser.add_argument(
+        "--rate-limits", action="store_true", help="не отключать ограничение частоты запросов"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="сохранить результаты в файл")
+    args = parser.parse_args()
+
+    configure(
+        args.db,
+        ADMIN_IDS=str(_BENCH_ADMIN_ID),
+        RATE_LIMIT_ENABLED=None if args.rate_limits else "false",
+        DB_SINGLE_WRITER="true" if args.single_writer else None,
+    )
+    report(asyncio.run(run(args)), args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+BENCH_GROUP_ID = -1000000000001
+BENCH_BOT_TOKEN = "123456:benchmark"
+
+
+def configure(db_path: str, **overrides: Any) -> None:
+    os.environ["DB_PATH"] = db_path
+    os.environ["GROUP_ID"] = str(BENCH_GROUP_ID)
+    os.environ.setdefault("BOT_TOKEN", BENCH_BOT_TOKEN)
+    for name, value in overrides.items():
+        if value is not None:
+            os.environ[name] = str(value)
+
+
+def percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+@dataclass
+class Result:
+    name: str
+    elapsed: float
+    latencies: list[float]
+    commits: int
+    extra: dict[str, Any] = field(default_factory=dict)
+
+    def as_dict(self) -> dict[str, Any]:
+        count = len(self.latencies)
+        return {
+            "name": self.name,
+            "count": count,
+            "elapsed": round(self.elapsed, 4),
+            "throughput": round(count / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(percentile(self.latencies, 0.5) * 1000, 3),
+            "p99_ms": round(percentile(self.latencies, 0.99) * 1000, 3),
+            "commits": self.commits,
+            **self.extra,
+        }
+
+
+class Timer:
+    def __init__(self) -> None:
+        from app.database.db import write_stats
+
+        self._write_stats = write_stats
+        self.started = time.perf_counter()
+        self._commits = write_stats.commits
+
+    def result(self, name: str, latencies: list[float], **extra: Any) -> Result:
+        return Result(
+            name=name,
+            elapsed=time.perf_counter() - self.started,
+            latencies=latencies,
+            commits=self._write_stats.commits - self._commits,
+            extra=extra,
+        )
+
+
+def report(results: list[Result], json_path: str | None = None) -> None:
+    for result in results:
+        row = result.as_dict()
+        extra = ", ".join(
+            f"{key}={value}"
+            for key, value in row.items()
+            if key not in {"name", "count", "elapsed", "throughput", "p50_ms", "p99_ms", "commits"}
+        )
+        print(
+            f"{row['name']:<22} {row['count']:>8} за {row['elapsed']:>7.2f} с "
+            f"{row['throughput']:>10.1f}/с  p50 {row['p50_ms']:>8.2f} мс  "
+            f"p99 {row['p99_ms']:>8.2f} мс  коммитов {row['commits']:>6}"
+            + (f"  ({extra})" if extra else "")
+        )
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as file:
+            json.dump([result.as_dict() for result in results], file, ensure_ascii=False, indent=2)
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import functools
+import random
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable
+
+from benchmarks.common import BENCH_BOT_TOKEN, BENCH_GROUP_ID, Result, Timer, configure, report
+
+_TEXTS = (
+    "Всем привет, как дела?",
+    "Кто сегодня играет вечером?",
+    "Отличная идея, поддерживаю",
+    "Скиньте ссылку на турнир пожалуйста",
+)
+
+
+def _member_joined(user_id: int, invite: dict[str, Any] | None) -> dict[str, Any]:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+    event = {
+        "chat": {"id": BENCH_GROUP_ID, "type": "supergroup", "title": "Pappy"},
+        "from": user,
+        "date": int(time.time()),
+        "old_chat_member": {"status": "left", "user": user},
+        "new_chat_member": {"status": "member", "user": user},
+    }
+    if invite is not None:
+        event["invite_link"] = invite
+    return event
+
+
+def _invite(inviter_id: int, link: str) -> dict[str, Any]:
+    return {
+        "invite_link": link,
+        "creator": {"id": inviter_id, "is_bot": False, "first_name": "Inviter"},
+        "creates_join_request": False,
+        "is_primary": False,
+        "is_revoked": False,
+    }
+
+
+def _load_population(db_path: str) -> tuple[int, list[tuple[int, str]]]:
+    conn = sqlite3.connect(db_path)
+    try:
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+        links = conn.execute("SELECT user_id, invite_link FROM invite_links").fetchall()
+    finally:
+        conn.close()
+    if not max_id:
+        raise SystemExit("База пуста, сначала запустите python -m benchmarks.seed.")
+    return int(max_id), [(int(user_id), link) for user_id, link in links]
+
+
+async def _replay(
+    items: list[Any], handler: Callable[[Any], Awaitable[None]], concurrency: int
+) -> list[float]:
+    latencies: list[float] = []
+    queue = iter(items)
+
+    async def worker() -> None:
+        for item in queue:
+            started = time.perf_counter()
+            await handler(item)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+async def run(args: argparse.Namespace) -> list[Result]:
+    from aiogram import Bot
+    from aiogram.types import ChatMemberUpdated, Message
+
+    from app.config import get_config
+    from app.database.db import close_pool, open_pool
+    from app.handlers.group import handle_group_text, handle_member_joined
+    from app.services.ingest import message_ingest
+    from app.tools.post_update import build_message_update
+
+    config = get_config()
+    max_id, links = _load_population(args.db)
+    rng = random.Random(args.seed)
+    bot = Bot(token=BENCH_BOT_TOKEN)
+
+    messages = [
+        Message.model_validate(
+            build_message_update(
+                rng.choice(_TEXTS),
+                user_id=rng.randint(1, max_id),
+                chat_id=BENCH_GROUP_ID,
+                username=None,
+            )["message"],
+            context={"bot": bot},
+        )
+        for _ in range(args.messages)
+    ]
+    joins = [
+        ChatMemberUpdated.model_validate(
+            _member_joined(user_id, _invite(*rng.choice(links)) if links else None),
+            context={"bot": bot},
+        )
+        for user_id in range(max_id + 1, max_id + 1 + args.joins)
+    ]
+
+    await open_pool()
+    try:
+        results = []
+        timer = Timer()
+        handler = functools.partial(handle_group_text, config=config)
+        latencies = await _replay(messages, handler, args.concurrency)
+        submitted = timer.result("handle_group_text", latencies)
+        await message_ingest.stop()
+        drained = timer.result(
+            "group_text+flush",
+            latencies,
+            batches=message_ingest.flushed_batches,
+            counted=message_ingest.counted_events,
+        )
+        results += [submitted, drained]
+
+        timer = Timer()
+        handler = functools.partial(handle_member_joined, config=config)
+        latencies = await _replay(joins, handler, args.concurrency)
+        results.append(timer.result("handle_member_joined", latencies))
+        return results
+    finally:
+        await message_ingest.stop()
+        await bot.session.close()
+        await close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Прогоняет сообщения и вступления в группу через обработчики."
+    )
+    parser.add_argument("--db", default="./bench.sqlite3")
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--joins", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--cooldown", type=int, default=None, help="переопределить MESSAGE_COOLDOWN")
+    parser.add_argument("--single-writer", action="store_true", help="включить DB_SINGLE_WRITER")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="сохранить результаты в файл")
+    args = parser.parse_args()
+
+    configure(
+        args.db,
+        MESSAGE_COOLDOWN=args.cooldown,
+        DB_SINGLE_WRITER="true" if args.single_writer else None,
+    )
+    report(asyncio.run(run(args)), args.json)
+
+
+if __name__ == "__main__":
+    main()
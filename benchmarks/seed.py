@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import time
+from typing import Iterator
+
+from benchmarks.common import configure
+
+INVITE_LINK_PREFIX = "https://t.me/+bench"
+_CHUNK_SIZE = 50000
+
+
+def invite_link(user_id: int) -> str:
+    return f"{INVITE_LINK_PREFIX}{user_id}"
+
+
+def _inviters(users: int, invited_share: float, rng: random.Random) -> list[int]:
+    invited_by = [0] * (users + 1)
+    for user_id in range(2, users + 1):
+        if rng.random() < invited_share:
+            invited_by[user_id] = 1 + int((user_id - 1) * rng.random() ** 3)
+    return invited_by
+
+
+def _user_rows(
+    users: int, invited_by: list[int], referrals: list[int], rng: random.Random
+) -> Iterator[tuple[int, str | None, int, int | None, int, int]]:
+    from app.services.ingest import MESSAGE_REWARD
+
+    for user_id in range(1, users + 1):
+        messages = int(referrals[user_id] * rng.random() * 40)
+        yield (
+            user_id,
+            f"user{user_id}" if user_id % 3 else None,
+            messages * MESSAGE_REWARD + rng.randrange(0, 200) * MESSAGE_REWARD,
+            invited_by[user_id] or None,
+            referrals[user_id],
+            messages,
+        )
+
+
+def _chunks(rows: Iterator[tuple], size: int = _CHUNK_SIZE) -> Iterator[list[tuple]]:
+    chunk: list[tuple] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _create_schema() -> None:
+    from app.database.db import close_pool, get_db
+    from app.database.schema import init_db
+
+    try:
+        async with get_db() as db:
+            await init_db(db)
+    finally:
+        await close_pool()
+
+
+def seed(db_path: str, users: int, invited_share: float, invite_links: int, seed_value: int) -> None:
+    rng = random.Random(seed_value)
+    invited_by = _inviters(users, invited_share, rng)
+    referrals = [0] * (users + 1)
+    for inviter_id in invited_by:
+        if inviter_id:
+            referrals[inviter_id] += 1
+
+    now_ts = int(time.time())
+    top_inviters = sorted(range(1, users + 1), key=referrals.__getitem__, reverse=True)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("BEGIN")
+        for chunk in _chunks(_user_rows(users, invited_by, referrals, rng)):
+            conn.executemany(
+                "INSERT INTO users (id, username, balance, invited_by, total_referrals, "
+                "total_referral_messages) VALUES (?, ?, ?, ?, ?, ?)",
+                chunk,
+            )
+        referral_rows = (
+            (inviter_id, user_id, now_ts)
+            for user_id, inviter_id in enumerate(invited_by)
+            if inviter_id
+        )
+        for chunk in _chunks(referral_rows):
+            conn.executemany(
+                "INSERT INTO referrals (inviter_id, invited_id, created_at) VALUES (?, ?, ?)",
+                chunk,
+            )
+        conn.executemany(
+            "INSERT INTO invite_links (user_id, invite_link, created_at) VALUES (?, ?, ?)",
+            [(user_id, invite_link(user_id), now_ts) for user_id in top_inviters[:invite_links]],
+        )
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Создаёт базу для нагрузочных тестов.")
+    parser.add_argument("--db", default="./bench.sqlite3")
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--invited-share", type=float, default=0.6, help="доля приглашённых")
+    parser.add_argument("--invite-links", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--force", action="store_true", help="пересоздать существующую базу")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.force:
+            raise SystemExit(f"{args.db} уже существует, используйте --force.")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    configure(args.db)
+    started = time.perf_counter()
+    asyncio.run(_create_schema())
+    seed(args.db, args.users, args.invited_share, args.invite_links, args.seed)
+    print(f"Создано {args.users} пользователей в {args.db} за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+from typing import Iterator
+
+import pytest
+
+from app.config import get_config
+
+
+@pytest.fixture(autouse=True)
+def config_env(tmp_path, monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    monkeypatch.setenv("BOT_TOKEN", "123456:test")
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "test.sqlite3"))
+    get_config.cache_clear()
+    yield
+    get_config.cache_clear()
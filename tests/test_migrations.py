@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+from typing import Any
+
+from app.database.db import ConnectionPool, uow
+from app.database.migrations import apply_migrations, current_version
+from app.database.schema import MIGRATIONS
+
+_BASELINE_SCHEMA = """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        balance REAL DEFAULT 0,
+        invited_by INTEGER,
+        total_referrals INTEGER DEFAULT 0,
+        total_referral_messages INTEGER DEFAULT 0
+    );
+    CREATE TABLE referrals (
+        inviter_id INTEGER NOT NULL,
+        invited_id INTEGER NOT NULL,
+        created_at INTEGER NOT NULL,
+        PRIMARY KEY (inviter_id, invited_id)
+    );
+    CREATE TABLE messages (
+        user_id INTEGER PRIMARY KEY,
+        last_message_time INTEGER NOT NULL,
+        counted_messages INTEGER DEFAULT 0
+    );
+    CREATE TABLE exchanges (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        steam_link TEXT NOT NULL,
+        timestamp INTEGER NOT NULL
+    );
+    CREATE TABLE invite_links (
+        user_id INTEGER PRIMARY KEY,
+        invite_link TEXT NOT NULL UNIQUE,
+        created_at INTEGER NOT NULL
+    );
+    CREATE INDEX idx_users_balance ON users(balance DESC);
+    CREATE INDEX idx_users_referrals ON users(total_referrals DESC);
+    CREATE INDEX idx_referrals_inviter ON referrals(inviter_id);
+    CREATE INDEX idx_exchanges_user ON exchanges(user_id);
+    CREATE INDEX idx_invite_links_link ON invite_links(invite_link);
+"""
+
+
+def _create_baseline(path: str) -> None:
+    with sqlite3.connect(path) as db:
+        db.executescript(_BASELINE_SCHEMA)
+        db.executemany(
+            "INSERT INTO users (id, username, balance, invited_by, total_referrals) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (1, "alice", 12.5, None, 1),
+                (2, "bob", 0.1 + 0.2, 1, 0),
+                (3, None, None, None, 0),
+                (4, "dave", 1.0000005, None, 0),
+            ],
+        )
+        db.execute("INSERT INTO referrals VALUES (1, 2, 1700000000)")
+        db.execute(
+            "INSERT INTO exchanges (user_id, amount, steam_link, timestamp) "
+            "VALUES (1, 10.0, 'https://steamcommunity.com/', 1700000000)"
+        )
+
+
+async def _stats(db: Any) -> dict[str, int]:
+    row = await db.execute_fetchone(
+        "SELECT users, referrals, exchanges, total_balance FROM stats_counters"
+    )
+    return dict(row)
+
+
+def test_baseline_database_is_migrated_once(tmp_path) -> None:
+    path = str(tmp_path / "baseline.sqlite3")
+    _create_baseline(path)
+
+    async def scenario() -> dict[str, Any]:
+        pool = ConnectionPool(path, readers=1, timeout=5)
+        await pool.open()
+        try:
+            async with pool.writer() as db:
+                result: dict[str, Any] = {"applied": await apply_migrations(db, MIGRATIONS)}
+                users = await db.execute_fetchall("SELECT id, balance FROM users ORDER BY id")
+                result["balances"] = [tuple(row) for row in users]
+                exchanges = await db.execute_fetchall("SELECT amount FROM exchanges")
+                result["amounts"] = [row["amount"] for row in exchanges]
+                result["types"] = {
+                    row["name"]: row["type"]
+                    for row in await db.execute_fetchall("PRAGMA table_info(users)")
+                }
+                result["indexes"] = {
+                    row["name"]
+                    for row in await db.execute_fetchall(
+                        "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+                    )
+                }
+                result["stats"] = await _stats(db)
+
+                async with uow(db):
+                    await db.execute("INSERT INTO users (id, balance) VALUES (5, 2000000)")
+                    await db.execute("UPDATE users SET balance = balance - 500000 WHERE id = 1")
+                    await db.execute("INSERT INTO referrals VALUES (1, 5, 1700000001)")
+                    await db.execute(
+                        "INSERT INTO exchanges (user_id, amount, steam_link, timestamp) "
+                        "VALUES (1, 500000, 'https://steamcommunity.com/', 1700000001)"
+                    )
+                    await db.execute("DELETE FROM users WHERE id = 3")
+                result["stats_after_writes"] = await _stats(db)
+
+                versions = await db.execute_fetchall("SELECT version FROM schema_version")
+                changes = db.total_changes
+                result["second_run"] = await apply_migrations(db, MIGRATIONS)
+                result["second_run_changes"] = db.total_changes - changes
+                result["in_transaction"] = db.in_transaction
+                result["versions"] = [row["version"] for row in versions]
+                result["version"] = await current_version(db)
+            return result
+        finally:
+            await pool.close()
+
+    result = asyncio.run(scenario())
+    assert result["applied"] == [migration.version for migration in MIGRATIONS]
+    assert result["types"]["balance"] == "INTEGER"
+    assert result["balances"] == [(1, 12_500_000), (2, 300_000), (3, 0), (4, 1_000_001)]
+    assert result["amounts"] == [10_000_000]
+    assert "idx_users_leaderboard_cover" in result["indexes"]
+    assert not {"idx_users_balance", "idx_users_referrals", "idx_invite_links_link"} & result[
+        "indexes"
+    ]
+    assert result["stats"] == {
+        "users": 4,
+        "referrals": 1,
+        "exchanges": 1,
+        "total_balance": 12_500_000 + 300_000 + 1_000_001,
+    }
+    assert result["stats_after_writes"] == {
+        "users": 4,
+        "referrals": 2,
+        "exchanges": 2,
+        "total_balance": 12_000_000 + 300_000 + 1_000_001 + 2_000_000,
+    }
+    assert result["second_run"] == []
+    assert result["second_run_changes"] == 0
+    assert not result["in_transaction"]
+    assert result["versions"] == [migration.version for migration in MIGRATIONS]
+    assert result["version"] == MIGRATIONS[-1].version
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import sqlite3
+
+import pytest
+
+from app.config import get_config
+from app.database.db import close_pool, get_db, open_pool
+from app.database.schema import init_db
+from app.services.ranking import OrderStatisticIndex, RankIndex, rank_key
+
+
+def _row(user_id: int, balance: int, total_referrals: int = 0) -> dict[str, int]:
+    return {"id": user_id, "balance": balance, "total_referrals": total_referrals}
+
+
+def test_order_statistic_index_matches_a_sorted_list() -> None:
+    rng = random.Random(7)
+    index = OrderStatisticIndex(block_size=4)
+    expected: list[tuple[int, int, int]] = []
+    for step in range(2000):
+        if expected and rng.random() < 0.4:
+            key = expected.pop(rng.randrange(len(expected)))
+            assert index.remove(key)
+            assert not index.remove(key)
+        else:
+            key = (rng.randint(-50, 0), rng.randint(-5, 0), step)
+            index.add(key)
+            expected.append(key)
+            expected.sort()
+        assert len(index) == len(expected)
+        if step % 50 == 0:
+            assert index.slice(0, len(expected)) == expected
+            for position, item in enumerate(expected):
+                assert index.index(item) == position
+
+    assert index.slice(-3, 2) == expected[:2]
+    assert index.slice(len(expected) - 2, len(expected) + 5) == expected[-2:]
+    assert index.slice(5, 5) == []
+    assert index.index((1, 0, 0)) == len(expected)
+
+
+def test_order_statistic_index_load_and_extend() -> None:
+    keys = [(-balance, 0, user_id) for user_id, balance in enumerate(range(100, 0, -1), 1)]
+    index = OrderStatisticIndex(block_size=8)
+    index.load(reversed(keys))
+    assert index.slice(0, 100) == keys
+
+    streamed = OrderStatisticIndex(block_size=8)
+    streamed.extend(keys[:30])
+    streamed.extend(keys[30:])
+    assert len(streamed) == 100
+    assert streamed.slice(37, 41) == keys[37:41]
+    assert streamed.index(keys[63]) == 63
+    with pytest.raises(ValueError):
+        streamed.extend([keys[0]])
+
+
+def test_position_follows_observed_changes() -> None:
+    ranking = RankIndex(rebuild_interval=0)
+    ranking.load([_row(1, 500), _row(2, 300, 2), _row(3, 300, 1), _row(4, 100), _row(5, 0)])
+
+    assert asyncio.run(ranking.position(3)) == (3, 5, [1, 2, 3, 4, 5])
+    assert asyncio.run(ranking.position(1, around=1)) == (1, 5, [1, 2])
+    assert asyncio.run(ranking.position(42)) is None
+
+    ranking.observe(_row(5, 1000))
+    assert asyncio.run(ranking.position(5, around=1)) == (1, 5, [5, 1])
+    assert asyncio.run(ranking.position(3, around=1)) == (4, 5, [2, 3, 4])
+
+    ranking.observe(_row(6, 300, 1))
+    assert asyncio.run(ranking.position(6, around=1)) == (5, 6, [3, 6, 4])
+    assert len(ranking) == 6
+
+    ranking.observe(_row(6, 300, 1))
+    assert len(ranking) == 6
+
+
+def test_refresh_streams_rows_and_replays_the_backlog() -> None:
+    path = get_config().db_path
+    users = [(user_id, (user_id * 37) % 101, user_id % 3) for user_id in range(1, 5001)]
+
+    async def scenario() -> tuple[list[int], tuple[int, int, list[int]] | None]:
+        await open_pool()
+        try:
+            async with get_db() as db:
+                await init_db(db)
+            with sqlite3.connect(path) as conn:
+                conn.executemany(
+                    "INSERT INTO users (id, balance, total_referrals) VALUES (?, ?, ?)", users
+                )
+            ranking = RankIndex(rebuild_interval=0)
+            refresh = asyncio.create_task(ranking.refresh())
+            await asyncio.sleep(0)
+            ranking.observe(_row(2500, 10_000))
+            await refresh
+            ranked = await ranking.position(2500, around=0)
+            order = ranking._ranks.slice(0, len(ranking))
+            return [key[2] for key in order], ranked
+        finally:
+            await close_pool()
+
+    order, ranked = asyncio.run(scenario())
+    rows = [_row(user_id, balance, referrals) for user_id, balance, referrals in users]
+    rows[2499] = _row(2500, 10_000)
+    assert order == [key[2] for key in sorted(rank_key(row) for row in rows)]
+    assert ranked == (1, 5000, [2500])
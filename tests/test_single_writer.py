@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any
+
+import pytest
+
+from app.database.db import ConnectionPool, uow, write_stats
+from app.services.metrics import db_write_batch_size, db_write_queue_depth
+
+
+async def _open(tmp_path) -> ConnectionPool:
+    pool = ConnectionPool(
+        str(tmp_path / "writer.sqlite3"), readers=1, timeout=5, single_writer=True
+    )
+    await pool.open()
+    async with pool.writer() as db, uow(db):
+        await db.execute("CREATE TABLE items (name TEXT NOT NULL)")
+    return pool
+
+
+async def _names(pool: ConnectionPool) -> list[str]:
+    async with pool.reader() as db:
+        rows = await db.execute_fetchall("SELECT name FROM items ORDER BY name")
+    return [row["name"] for row in rows]
+
+
+def test_nested_uow_rolls_back_only_the_savepoint(
+    tmp_path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("DB_GROUP_COMMIT_MS", "0")
+
+    async def scenario() -> tuple[list[str], list[str]]:
+        pool = await _open(tmp_path)
+        committed: list[str] = []
+        try:
+            async with pool.writer() as db, uow(db):
+                await db.execute("INSERT INTO items (name) VALUES ('outer')")
+                db.on_commit(lambda: committed.append("outer"))
+                with pytest.raises(ValueError):
+                    async with uow(db):
+                        await db.execute("INSERT INTO items (name) VALUES ('inner')")
+                        db.on_commit(lambda: committed.append("inner"))
+                        raise ValueError
+                async with uow(db):
+                    await db.execute("INSERT INTO items (name) VALUES ('nested')")
+                    db.on_commit(lambda: committed.append("nested"))
+                assert committed == []
+            return await _names(pool), committed
+        finally:
+            await pool.close()
+
+    names, committed = asyncio.run(scenario())
+    assert names == ["nested", "outer"]
+    assert committed == ["outer", "nested"]
+
+
+def test_failed_command_does_not_break_the_batch(
+    tmp_path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("DB_GROUP_COMMIT_MS", "50")
+
+    async def write(pool: ConnectionPool, name: str, fail: bool) -> None:
+        async with pool.writer() as db, uow(db):
+            await db.execute("INSERT INTO items (name) VALUES (?)", (name,))
+            if fail:
+                raise ValueError(name)
+
+    async def scenario() -> tuple[list[Any], list[str], dict[str, float]]:
+        pool = await _open(tmp_path)
+        try:
+            results = await asyncio.gather(
+                write(pool, "a", False),
+                write(pool, "b", True),
+                write(pool, "c", False),
+                return_exceptions=True,
+            )
+            return results, await _names(pool), pool.stats()["single_writer"]
+        finally:
+            await pool.close()
+
+    results, names, stats = asyncio.run(scenario())
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], ValueError)
+    assert names == ["a", "c"]
+    assert stats["batches"] == 2
+    assert stats["commands"] == 4
+
+
+def test_concurrent_writes_share_a_commit(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("DB_GROUP_COMMIT_MS", "50")
+    monkeypatch.setenv("DB_GROUP_COMMIT_SIZE", "8")
+    writers = 20
+
+    async def write(pool: ConnectionPool, index: int) -> None:
+        async with pool.writer() as db, uow(db):
+            await db.execute("INSERT INTO items (name) VALUES (?)", (f"item{index:02d}",))
+
+    async def scenario() -> tuple[list[str], dict[str, float], int]:
+        pool = await _open(tmp_path)
+        try:
+            commits = write_stats.commits
+            await asyncio.gather(*(write(pool, index) for index in range(writers)))
+            return await _names(pool), pool.stats()["single_writer"], write_stats.commits - commits
+        finally:
+            await pool.close()
+
+    batch_sizes = db_write_batch_size.labels()
+    observed = batch_sizes.count
+    names, stats, commits = asyncio.run(scenario())
+    assert names == [f"item{index:02d}" for index in range(writers)]
+    assert stats["commands"] == writers + 1
+    assert stats["batches"] == 1 + commits
+    assert commits == 3
+    assert stats["max_queue_depth"] >= 8
+    assert batch_sizes.count - observed == stats["batches"]
+    assert db_write_queue_depth.labels().value == 0